@@ -4,6 +4,7 @@ import gc
 import os
 import sys
 import tempfile
+import threading
 import time
 import warnings
 from dataclasses import dataclass
@@ -75,6 +76,77 @@ def is_main_thread():
     return threading.current_thread() is threading.main_thread()
 
 
+# Optional executor of long-lived processes with bpy already imported. When
+# enabled (e.g. by the API server), `vis_blender` calls made off the main thread
+# and the server's renders use it instead of starting a fresh Blender each time.
+# Owned here so every caller sees the same pool, including after a rebuild.
+BLENDER_POOL = None
+_BLENDER_POOL_WORKERS = 0
+_BLENDER_POOL_LOCK = threading.Lock()
+
+
+def _new_blender_pool():
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Spawned rather than forked: the parent has CUDA initialised by the time jobs run
+    return ProcessPoolExecutor(max_workers=_BLENDER_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def enable_blender_pool(max_workers: int):
+    """Creates `BLENDER_POOL` with `max_workers` spawned processes."""
+    global BLENDER_POOL, _BLENDER_POOL_WORKERS
+    with _BLENDER_POOL_LOCK:
+        _BLENDER_POOL_WORKERS = max_workers
+        BLENDER_POOL = _new_blender_pool()
+
+
+def get_blender_pool():
+    """The current Blender pool, or None when it isn't enabled."""
+    return BLENDER_POOL
+
+
+def replace_broken_blender_pool(broken_pool):
+    """
+    Rebuilds the pool after a crashed Blender broke `broken_pool`. Concurrent
+    callers that hit the same broken pool only rebuild it once.
+    """
+    global BLENDER_POOL
+    with _BLENDER_POOL_LOCK:
+        if BLENDER_POOL is not broken_pool or broken_pool is None:
+            return
+        print("Blender pool is broken, starting a new one")
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+        BLENDER_POOL = _new_blender_pool()
+
+
+def shutdown_blender_pool():
+    global BLENDER_POOL
+    with _BLENDER_POOL_LOCK:
+        if BLENDER_POOL is not None:
+            BLENDER_POOL.shutdown(wait=False, cancel_futures=True)
+            BLENDER_POOL = None
+
+
+def run_in_blender_pool(args) -> bool:
+    """Runs `app_blender.main(args)` in `BLENDER_POOL`; returns False if no pool is usable."""
+    pool = get_blender_pool()
+    if pool is None:
+        return False
+    from concurrent.futures.process import BrokenProcessPool
+
+    from app_blender import main
+
+    try:
+        pool.submit(main, args).result()
+    except BrokenProcessPool:
+        # A crashed Blender takes the pool down with it; this call falls back to
+        # a fresh process and later ones get the rebuilt pool
+        replace_broken_blender_pool(pool)
+        return False
+    return True
+
+
 # Monkey patching gradio to use let gr.Info & gr.Warning also print on console
 def _log_message(
     message: str,
@@ -1049,26 +1121,27 @@ def vis_blender(
                 "'Reset to Rest' is not enabled, so the animation may be incorrect if the input is not in T-pose"
             )
 
+    from argparse import Namespace
+
+    blender_args = Namespace(
+        input_path=data,
+        output_path=db.anim_path,
+        template_path=template_path,
+        keep_raw=False,
+        rest_path=db.rest_vis_path if db.is_mesh else None,
+        pose_local=False,
+        reset_to_rest=reset_to_rest,
+        remove_fingers=remove_fingers,
+        animation_path=animation_file,
+        retarget=retarget,
+        inplace=inplace,
+    )
     if is_main_thread():
-        from argparse import Namespace
-
         from app_blender import main
 
-        main(
-            Namespace(
-                input_path=data,
-                output_path=db.anim_path,
-                template_path=template_path,
-                keep_raw=False,
-                rest_path=db.rest_vis_path if db.is_mesh else None,
-                pose_local=False,
-                reset_to_rest=reset_to_rest,
-                remove_fingers=remove_fingers,
-                animation_path=animation_file,
-                retarget=retarget,
-                inplace=inplace,
-            )
-        )
+        main(blender_args)
+    elif run_in_blender_pool(blender_args):
+        pass
     else:
         # Directly call bpy here causes crash, because Blender does not support modifying data in child threads
         with tempfile.NamedTemporaryFile(suffix=".npz") as f:
@@ -1,13 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import subprocess
+import os
+import shutil
+import stat
 from typing import TYPE_CHECKING
 import logging
 import sys
 import zipfile
 
+import httpx
+
 from jobs.utils.azure import download_zip_from_azure_if_missing
 from models.make_it_animatable.server.server import run_pipeline, init_models
-from models.make_it_animatable.util import render_thumbnail, render_glb_frames
+from models.make_it_animatable.util import render_glb_frames
 
 sys.path.append("/home/ray/csm")
 from jobs.api_models import MakeItAnimatableJob, MakeItAnimatableJobUpdate
@@ -18,6 +23,20 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# Timeout (in seconds) for each ranged request of a parallel download.
+DOWNLOAD_TIMEOUT = 60.0
+
+# Whether to render and upload the thumbnail and GIF previews alongside the GLB.
+RENDER_PREVIEWS = False
+
+
+def _link_or_copy(src, dst):
+    """Hard-links `src` to `dst`, falling back to a copy across filesystems."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
 
 class MakeItAnimatableJobHandler(
     JobHandler[MakeItAnimatableJob, MakeItAnimatableJobUpdate]
@@ -28,59 +47,129 @@ class MakeItAnimatableJobHandler(
         )
         self.job_class = MakeItAnimatableJob
         self.job_update_class = MakeItAnimatableJobUpdate
+        # Network-bound bookkeeping/uploads run here so they overlap with the pipeline
+        self._io_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mia-io")
 
-        init_models()
+        # Load model weights in the background so they overlap with the first
+        # job's download; run_job waits on this before running the pipeline
+        self._models_future = self._io_pool.submit(init_models)
 
     @classmethod
     def preload(cls, cache_path: Path = Path("/home/ray")):
-        if Path("/home/ray/csm/models/make_it_animatable/data").exists():
+        model_data_path = Path("/home/ray/csm/models/make_it_animatable/data")
+        if model_data_path.exists():
             logger.info("Data already downloaded")
             return
         data_path = cache_path / "make_it_animatable_data"
         logger.info("Downloading data")
         download_zip_from_azure_if_missing("make_it_animatable_data.zip", data_path)
 
-        subprocess.run(
-            ["cp", "-r", data_path / "data", Path("/home/ray/csm/models/make_it_animatable/data")]
-        )
-        subprocess.run(
-            ["chmod", "+x", "/home/ray/csm/models/make_it_animatable/data/FBX2glTF"]
-        )
+        fbx2gltf_path = model_data_path / "FBX2glTF"
+        try:
+            # Hard-link instead of copying: no file data is rewritten and the
+            # cached download stays intact for future installs
+            shutil.copytree(data_path / "data", model_data_path, copy_function=_link_or_copy)
+            os.chmod(
+                fbx2gltf_path,
+                os.stat(fbx2gltf_path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH,
+            )
+        except OSError:
+            logger.exception("Failed to install Make-It-Animatable data")
+            raise
         logger.info("Data downloaded")
 
+    def _download_file_parallel(
+        self,
+        url: str,
+        path: Path,
+        chunk_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 8,
+    ):
+        """
+        Downloads `url` to `path` with concurrent byte-range GETs, each chunk written
+        at its offset. Falls back to the sequential `_download_file` for small files,
+        servers without range support, or any failure along the way.
+        """
+        try:
+            with httpx.Client(
+                follow_redirects=True,
+                timeout=DOWNLOAD_TIMEOUT,
+                limits=httpx.Limits(max_connections=max_concurrency),
+            ) as client:
+                head = client.head(url)
+                head.raise_for_status()
+                size = int(head.headers.get("content-length", 0))
+                if size <= chunk_size or head.headers.get("accept-ranges") != "bytes":
+                    return self._download_file(url, path)
+
+                def fetch(start):
+                    end = min(start + chunk_size, size) - 1
+                    resp = client.get(url, headers={"Range": f"bytes={start}-{end}"})
+                    resp.raise_for_status()
+                    if resp.status_code != 206 or len(resp.content) != end - start + 1:
+                        raise ValueError(f"Server ignored range request for bytes {start}-{end}")
+                    os.pwrite(fd, resp.content, start)
+
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    os.ftruncate(fd, size)
+                    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+                        # list() surfaces the first exception raised by any chunk
+                        list(pool.map(fetch, range(0, size, chunk_size)))
+                finally:
+                    os.close(fd)
+        except (httpx.HTTPError, OSError, ValueError) as e:
+            logger.warning(f"Parallel download of {url} failed ({e}), retrying sequentially")
+            return self._download_file(url, path)
+
     def run_job(self, job):
         # download mesh
         mesh_extension = job.input_mesh_url.split(".")[-1].split("?")[0]
         mesh_path = self._scratch_dir() / f"mesh.{mesh_extension}"
-        self._download_file(job.input_mesh_url, mesh_path)
-
-        self._checkpoint("mesh_downloaded")
+        self._download_file_parallel(job.input_mesh_url, mesh_path)
 
-        with open(mesh_path, "rb") as f:
-            mesh_bytes = f.read()
+        # Report progress in the background; the pipeline stays on this thread
+        # because Blender must be driven from the main thread
+        checkpoint_future = self._io_pool.submit(self._checkpoint, "mesh_downloaded")
 
-        db = run_pipeline(mesh_bytes, job.animation_name)
+        # Re-raises here if the background model load failed
+        self._models_future.result()
 
-        self._checkpoint("animation_generated")
+        # The pipeline reads the downloaded file in place
+        db = run_pipeline(mesh_path, job.animation_name)
+        checkpoint_future.result()
 
         glb_path = db.anim_vis_path
+        glb_future = self._io_pool.submit(self._upload_file, Path(glb_path), Path("animation.glb"))
+        self._checkpoint("animation_generated")
 
-        # thumbnail_path = self._scratch_dir() / f"thumbnail.png"
-        # render_thumbnail.render_thumbnail(glb_path, str(thumbnail_path))
-
-        # frames_output_dir = self._scratch_dir() / "frames"
-        # gif_path = Path(
-        #     render_glb_frames.render_frames(glb_path, str(frames_output_dir))
-        # )
-
-        # upload files
-        # thumbnail_url = self._upload_file(thumbnail_path, Path("thumbnail.png"))
-        # gif_url = self._upload_file(gif_path, Path("animation.gif"))
-        glb_url = self._upload_file(Path(glb_path), Path("animation.glb"))
+        # Render the previews on this thread (Blender is not thread-safe) while the
+        # uploads of everything already produced proceed in the background
+        preview_urls = {}
+        if RENDER_PREVIEWS:
+            # One import and scene setup serves both the thumbnail and the GIF
+            thumbnail_path = self._scratch_dir() / "thumbnail.png"
+            frames_output_dir = self._scratch_dir() / "frames"
+            gif_path = Path(
+                render_glb_frames.render_frames(
+                    glb_path, str(frames_output_dir), thumbnail_path=str(thumbnail_path)
+                )
+            )
+            # render_frames only logs a failed thumbnail; a job without one is still a failure
+            if not thumbnail_path.is_file():
+                raise RuntimeError(f"Thumbnail was not rendered to {thumbnail_path}")
+            thumbnail_future = self._io_pool.submit(self._upload_file, thumbnail_path, Path("thumbnail.png"))
+            gif_future = self._io_pool.submit(self._upload_file, gif_path, Path("animation.gif"))
+
+            preview_urls = dict(
+                output_thumbnail_url=thumbnail_future.result(),
+                output_gif_url=gif_future.result(),
+            )
+
+        glb_url = glb_future.result()
 
         return MakeItAnimatableJobUpdate(
             status="complete",
-            # output_thumbnail_url=thumbnail_url,
-            # output_gif_url=gif_url,
             output_glb_url=glb_url,
+            **preview_urls,
         )
@@ -1,13 +1,45 @@
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from jobs.api_models import TestMakeItAnimatableJob
 from jobs.utils.testing import LocalTester
 
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected an integer >= 1, got {value}")
+    return number
+
+
+parser = argparse.ArgumentParser(description="Run Make-It-Animatable test jobs, optionally concurrently.")
+parser.add_argument("-n", "--num-jobs", type=positive_int, default=1, help="Total number of test jobs to run.")
+parser.add_argument("-c", "--concurrency", type=positive_int, default=16, help="Maximum number of jobs in flight at once.")
+args = parser.parse_args()
+
 tester = LocalTester(type="make_it_animatable", port=7778)
 
-tester.run_test(
-    TestMakeItAnimatableJob(
-        _id="purpleguy",
+
+def run(index):
+    job = TestMakeItAnimatableJob(
+        _id="purpleguy" if args.num_jobs == 1 else f"purpleguy-{index}",
         input_mesh_url=tester.local_url(Path("jobs/test_storage/purpleguy.glb")),
         animation_name="jumping",
     )
-)
+    start = time.perf_counter()
+    tester.run_test(job)
+    return time.perf_counter() - start
+
+
+wall_start = time.perf_counter()
+with ThreadPoolExecutor(max_workers=min(args.concurrency, args.num_jobs)) as executor:
+    latencies = sorted(executor.map(run, range(args.num_jobs)))
+wall_time = time.perf_counter() - wall_start
+
+if args.num_jobs > 1:
+    # quantiles() interpolates between samples: 99 cut points give p1..p99
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    print(f"{args.num_jobs} jobs in {wall_time:.2f}s ({args.num_jobs / wall_time:.2f} jobs/s)")
+    print(f"latency p50={percentiles[49]:.2f}s p95={percentiles[94]:.2f}s p99={percentiles[98]:.2f}s max={latencies[-1]:.2f}s")
@@ -0,0 +1,14 @@
+# config.py
+# Shared server configuration used by the launch, kill and router scripts.
+
+# Map environment names to their respective port configurations.
+CONFIG_MAPPING = {
+    "dev": {
+        "worker_ports": [8001, 8002, 8003],
+        "router_port": 8000
+    },
+    "prod": {
+        "worker_ports": [9001, 9002, 9003],
+        "router_port": 9000
+    },
+}
@@ -3,38 +3,107 @@ import subprocess
 import sys
 import argparse
 import platform
+import os
+import signal
+import time
 
-# --- Configuration (Copied from your launch script) ---
-# Map environment names to their respective port configurations.
-CONFIG_MAPPING = {
-    "dev": {
-        "worker_ports": [8001, 8002, 8003],
-        "router_port": 8000
-    },
-    "prod": {
-        "worker_ports": [9001, 9002, 9003],
-        "router_port": 9000
-    },
-}
+# --- Configuration ---
+from config import CONFIG_MAPPING
+
+# TCP state code for LISTEN in /proc/net/tcp[6].
+_TCP_LISTEN = "0A"
+
+def _linux_pids_on_ports(ports: set[int]) -> dict[int, list[str]]:
+    """
+    Finds the PIDs listening on any of the given ports by reading /proc directly.
+    Parses /proc/net/tcp and /proc/net/tcp6 for LISTEN sockets, then walks
+    /proc/[pid]/fd once to map socket inodes back to their owning processes.
+    Returns a dict mapping each port to the list of PIDs found on it.
+    """
+    inode_to_port = {}
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f, None)  # Skip the header line
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 10 or fields[3] != _TCP_LISTEN:
+                        continue
+                    # local_address is "<hex ip>:<hex port>"
+                    port = int(fields[1].split(":")[1], 16)
+                    if port in ports:
+                        inode_to_port[fields[9]] = port
+        except FileNotFoundError:
+            continue  # e.g. IPv6 disabled
+
+    pids_by_port = {port: [] for port in ports}
+    if not inode_to_port:
+        return pids_by_port
+
+    with os.scandir("/proc") as proc_entries:
+        for proc_entry in proc_entries:
+            if not proc_entry.name.isdigit():
+                continue
+            pid = proc_entry.name
+            try:
+                with os.scandir(f"/proc/{pid}/fd") as fd_entries:
+                    for fd_entry in fd_entries:
+                        try:
+                            target = os.readlink(fd_entry.path)
+                        except OSError:
+                            continue
+                        # Socket fds link to "socket:[<inode>]"
+                        if not target.startswith("socket:["):
+                            continue
+                        port = inode_to_port.get(target[8:-1])
+                        if port is not None and pid not in pids_by_port[port]:
+                            pids_by_port[port].append(pid)
+            except (PermissionError, FileNotFoundError, ProcessLookupError):
+                # Process exited or belongs to another user
+                continue
+    return pids_by_port
+
+def _lsof_all_listening() -> dict[int, list[str]]:
+    """
+    Lists every listening TCP socket with a single lsof call.
+    Parses lsof's field output (-F), where a "p<pid>" record is followed by
+    "n<host>:<port>" records for each of that process' sockets.
+    Returns a dict mapping each listening port to the list of PIDs on it.
+    """
+    # -n/-P: skip DNS and port-name lookups; -sTCP:LISTEN: only listening sockets
+    command = ["lsof", "-nP", "-iTCP", "-sTCP:LISTEN", "-Fpn"]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0 and result.stdout.strip():
+        raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+
+    pids_by_port = {}
+    pid = None
+    for line in result.stdout.splitlines():
+        if line.startswith("p"):
+            pid = line[1:]
+        elif line.startswith("n") and pid is not None:
+            port = line.rsplit(":", 1)[-1]
+            if port.isdigit():
+                pids = pids_by_port.setdefault(int(port), [])
+                if pid not in pids:
+                    pids.append(pid)
+    return pids_by_port
 
 def get_pids_on_port(port):
     """
     Finds the Process ID (PID) of the process listening on the given port.
-    Supports both Unix-like systems (Linux/macOS) and Windows.
+    Supports Linux (via /proc), macOS (via lsof) and Windows (via netstat).
     Returns a list of PIDs found on the port.
     """
     system = platform.system()
     pids = []
 
     try:
-        if system == "Linux" or system == "Darwin":  # Linux or macOS
+        if system == "Linux":
+            pids = _linux_pids_on_ports({port})[port]
+        elif system == "Darwin":  # macOS
             # Use lsof to find the process ID listening on the port
-            # -t: output PIDs only
-            command = ["lsof", "-t", "-i", f":{port}"]
-            result = subprocess.run(command, capture_output=True, text=True, check=True)
-            if result.stdout:
-                # Split by newline and filter out empty strings to get a list of PIDs
-                pids = [pid.strip() for pid in result.stdout.strip().split('\n') if pid.strip()]
+            pids = _lsof_all_listening().get(port, [])
         elif system == "Windows":
             # Use netstat to find the PID
             command = ["netstat", "-ano"]
@@ -61,41 +130,95 @@ def get_pids_on_port(port):
             print(f"❌ Error executing command to find PID for port {port}: {e}")
             print(f"   Stderr: {e.stderr}")
     except FileNotFoundError:
-        if system == "Linux" or system == "Darwin":
-            print(f"❌ Error: 'lsof' command not found. Please install it (e.g., 'sudo apt-get install lsof' or 'brew install lsof').")
+        if system == "Darwin":
+            print(f"❌ Error: 'lsof' command not found. Please install it (e.g., 'brew install lsof').")
         elif system == "Windows":
             print(f"❌ Error: 'netstat' command not found. This is unusual for Windows.")
         sys.exit(1)
     
     return pids
 
+def get_pids_on_ports(ports):
+    """
+    Finds the PIDs listening on each of the given ports.
+    On Linux all ports are resolved with a single /proc walk and on macOS with
+    a single lsof call; other systems fall back to one lookup per port.
+    Returns a dict mapping each port to the list of PIDs found on it.
+    """
+    system = platform.system()
+    if system == "Linux":
+        return _linux_pids_on_ports(set(ports))
+    if system == "Darwin":
+        try:
+            pids_by_port = _lsof_all_listening()
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            # Let the per-port lookup report the error
+            return {port: get_pids_on_port(port) for port in ports}
+        return {port: pids_by_port.get(port, []) for port in ports}
+    return {port: get_pids_on_port(port) for port in ports}
+
+def wait_terminated(pid, timeout=0.5, interval=0.02):
+    """
+    Polls until the process with the given PID has exited, escalating to
+    SIGKILL if it is still alive after `timeout` seconds.
+    Returns True if the process had to be force-killed.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            os.kill(pid, 0)  # Signal 0 only checks whether the process exists
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return False  # Exists but owned by another user; nothing more we can do
+        time.sleep(interval)
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        return False
+    return True
+
+def _terminate_windows_process(pid):
+    """
+    Terminates a process on Windows through the Win32 API without spawning taskkill.
+    """
+    import ctypes
+
+    PROCESS_TERMINATE = 0x0001
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(PROCESS_TERMINATE, False, pid)
+    if not handle:
+        raise OSError(f"OpenProcess failed (error {kernel32.GetLastError()})")
+    try:
+        if not kernel32.TerminateProcess(handle, 1):
+            raise OSError(f"TerminateProcess failed (error {kernel32.GetLastError()})")
+    finally:
+        kernel32.CloseHandle(handle)
+
 def kill_process(pid, port):
     """
     Kills the process with the given PID.
     Supports both Unix-like systems (Linux/macOS) and Windows.
     """
     system = platform.system()
+    pid = int(pid)
     try:
         if system == "Linux" or system == "Darwin":  # Linux or macOS
-            command = ["kill", str(pid)]
-            subprocess.run(command, check=True)
+            os.kill(pid, signal.SIGTERM)
+            if wait_terminated(pid):
+                print(f"   ⚠️ Process {pid} on port {port} ignored SIGTERM and was force-killed.")
             print(f"   ✅ Successfully killed process {pid} on port {port}.")
         elif system == "Windows":
-            # /F forcefully terminates the process
-            command = ["taskkill", "/PID", str(pid), "/F"]
-            subprocess.run(command, check=True)
+            _terminate_windows_process(pid)
             print(f"   ✅ Successfully killed process {pid} on port {port}.")
         else:
             print(f"⚠️ Warning: Unsupported operating system '{system}'. Cannot reliably kill process {pid}.")
-    except subprocess.CalledProcessError as e:
+    except ProcessLookupError:
+        print(f"   ℹ️ Process {pid} on port {port} had already exited.")
+    except PermissionError as e:
+        print(f"❌ Failed to kill process {pid} on port {port}: permission denied ({e}).")
+    except OSError as e:
         print(f"❌ Failed to kill process {pid} on port {port}: {e}")
-        print(f"   Stderr: {e.stderr}")
-    except FileNotFoundError:
-        if system == "Linux" or system == "Darwin":
-            print(f"❌ Error: 'kill' command not found. This is unusual.")
-        elif system == "Windows":
-            print(f"❌ Error: 'taskkill' command not found. This is unusual.")
-        sys.exit(1)
 
 def kill_all_servers_by_port(config, environment_name):
     """
@@ -109,10 +232,12 @@ def kill_all_servers_by_port(config, environment_name):
     
     print(f"🛑 Attempting to kill server processes for '{environment_name.upper()}' environment...")
 
+    pids_by_port = get_pids_on_ports(all_ports)
+
     processes_killed_count = 0
     for port in all_ports:
         print(f"\nSearching for processes on port {port}...")
-        pids = get_pids_on_port(port)
+        pids = pids_by_port[port]
         
         if pids:
             print(f"   Found process(es) with PID(s) {', '.join(pids)} on port {port}. Attempting to kill...")
@@ -3,23 +3,79 @@ import time
 import sys
 import argparse
 import os # Import os module
+import signal
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
-# Map environment names to their respective port configurations.
-CONFIG_MAPPING = {
-    "dev": {
-        "worker_ports": [8001, 8002, 8003],
-        "router_port": 8000
-    },
-    "prod": {
-        "worker_ports": [9001, 9002, 9003],
-        "router_port": 9000
-    },
-}
+from config import CONFIG_MAPPING
 
 # GPU IDs remain constant regardless of the environment.
 GPU_IDS = [5, 6, 7]
 
+# How long (in seconds) to wait for each worker to pass its health check,
+# and how often to poll it.
+WORKER_READY_TIMEOUT = 60.0
+WORKER_READY_POLL_INTERVAL = 0.1
+
+# How long (in seconds) a worker gets to exit after SIGTERM before it is killed.
+WORKER_STOP_TIMEOUT = 10.0
+
+def _wait_healthy(url, process, timeout=WORKER_READY_TIMEOUT):
+    """
+    Polls the given health URL until it answers with HTTP 200.
+    Returns True once healthy, False on timeout or if the process exits first.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(url, timeout=1.0) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            pass
+        time.sleep(WORKER_READY_POLL_INTERVAL)
+    return False
+
+def _signal_worker(process, sig):
+    """
+    Sends sig to a worker's whole session, so its Blender pool and other
+    children go down with it; falls back to the process alone off POSIX.
+    """
+    try:
+        if hasattr(os, "killpg"):
+            # Each worker leads its own session, so its PID is also its group ID
+            os.killpg(process.pid, sig)
+        elif sig == signal.SIGTERM:
+            process.terminate()
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+def _stop_workers(processes, timeout=WORKER_STOP_TIMEOUT):
+    """
+    Terminates the launched workers before the launcher exits. They run in
+    their own sessions, so nothing else would stop them and they would keep
+    their ports bound. Workers still alive after the timeout are killed.
+    """
+    running = [p for p in processes if p.poll() is None]
+    if not running:
+        return
+    print(f"🛑 Stopping {len(running)} launched worker(s)...")
+    for process in running:
+        _signal_worker(process, signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    for process in running:
+        try:
+            process.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            _signal_worker(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+            process.wait()
+
 def launch_all_servers(config, environment_name):
     """
     Launches multiple worker servers and a corresponding router server
@@ -38,28 +94,54 @@ def launch_all_servers(config, environment_name):
     # Get a copy of the current environment variables to pass to subprocesses
     current_env = os.environ.copy()
 
+    worker_processes = []
     for port, gpu_id in zip(worker_ports, GPU_IDS):
         # Set CUDA_VISIBLE_DEVICES in the environment for this specific subprocess
-        worker_env = current_env.copy()
-        worker_env["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
+        worker_env = {**current_env, "CUDA_VISIBLE_DEVICES": str(gpu_id)}
         
         # Command as a list of arguments for security (no shell=True)
         command = ["python", "server.py", "--port", str(port)]
         
         print(f"   - Executing worker command: {' '.join(command)} with CUDA_VISIBLE_DEVICES={gpu_id}")
         try:
-            # Use Popen without shell=True, pass env and redirect stdout/stderr
-            subprocess.Popen(command, env=worker_env, stdout=sys.stdout, stderr=sys.stderr)
+            # Use Popen without shell=True, pass env and redirect stdout/stderr.
+            # Each worker leads its own session so a Ctrl-C aimed at the launcher or
+            # router does not interrupt it mid-CUDA-init, and inherits no stray fds.
+            worker_processes.append(
+                subprocess.Popen(
+                    command,
+                    env=worker_env,
+                    stdout=sys.stdout,
+                    stderr=sys.stderr,
+                    start_new_session=True,
+                    close_fds=True,
+                )
+            )
         except FileNotFoundError:
             print("❌ Error: 'python' command not found. Make sure Python is in your system's PATH.")
+            _stop_workers(worker_processes)
             sys.exit(1)
         except Exception as e:
             print(f"❌ An unexpected error occurred while launching worker on port {port}: {e}")
+            _stop_workers(worker_processes)
             sys.exit(1)
 
-    print("\n✅ Worker servers launched.")
-    # Give workers a moment to start up before launching the router
-    time.sleep(3)
+    print("\n✅ Worker servers launched. Waiting for them to become healthy...")
+    # Probe all workers in parallel so the router only starts once they are listening
+    with ThreadPoolExecutor(max_workers=len(worker_ports)) as executor:
+        ready = list(executor.map(
+            lambda args: _wait_healthy(f"http://localhost:{args[0]}/health", args[1]),
+            zip(worker_ports, worker_processes),
+        ))
+    for port, process, is_ready in zip(worker_ports, worker_processes, ready):
+        if is_ready:
+            print(f"   ✅ Worker on port {port} is healthy.")
+        elif process.poll() is not None:
+            print(f"❌ Error: Worker on port {port} exited with code {process.returncode} during startup.")
+            _stop_workers(worker_processes)
+            sys.exit(1)
+        else:
+            print(f"   ⚠️ Worker on port {port} is not healthy after {WORKER_READY_TIMEOUT:.0f}s; the router will retry it later.")
 
     # --- 2. Launch Router Server ---
     print(f"\n🚀 Launching router for '{environment_name.upper()}' environment...")
@@ -73,9 +155,11 @@ def launch_all_servers(config, environment_name):
         subprocess.Popen(router_command, stdout=sys.stdout, stderr=sys.stderr)
     except FileNotFoundError:
         print("❌ Error: 'python' command not found.")
+        _stop_workers(worker_processes)
         sys.exit(1)
     except Exception as e:
         print(f"❌ An unexpected error occurred while launching router: {e}")
+        _stop_workers(worker_processes)
         sys.exit(1)
 
     print("\n✅ All server instances have been launched in the background.")
@@ -1,23 +1,58 @@
 # router.py
+import asyncio
+import collections
+import hashlib
 import httpx
 import itertools
+import time
 from typing import List, Optional, Literal
 import argparse
+import os
 import sys
+import tempfile
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 
+from config import CONFIG_MAPPING
+
 # Timeout for requests to worker servers (in seconds).
 WORKER_TIMEOUT = 300.0
 
-# --- Pydantic Model ---
-# This model MUST exactly match the AnimationRequest model in server.py
+# Workers that refuse connections are skipped for 2**fails seconds, capped here.
+WORKER_MAX_COOLDOWN = 30.0
+
+# How often (in seconds) workers in cooldown are re-probed in the background.
+HEALTH_PROBE_INTERVAL = 5.0
+
+# Timeout (in seconds) for the startup health probe of each worker.
+HEALTH_PROBE_TIMEOUT = 2.0
+
+# Bounds for the in-memory cache of successful worker responses, shared out
+# evenly between the router processes since each one keeps its own cache.
+RESULT_CACHE_MAX_ENTRIES = 128
+RESULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Streamed request bodies up to this size are spooled in memory, larger ones on disk.
+STREAM_SPOOL_MAX_MEMORY = 16 * 1024 * 1024
+
+# Connection pool limits for the shared client used to forward requests.
+WORKER_CONNECTION_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+# Environment variable through which the router environment reaches uvicorn worker processes.
+ROUTER_ENV_VAR = "ROUTER_ENV"
+# Environment variable through which the router process count reaches uvicorn worker processes.
+ROUTER_WORKERS_VAR = "ROUTER_WORKERS"
+
+# --- Pydantic Models ---
+# These models MUST exactly match the ones in server.py
 # to ensure proper validation and serialization.
-class AnimationRequest(BaseModel):
-    mesh_b64_str: str
+class AnimationOptions(BaseModel):
     animation_name: Literal["running", "jumping", "punching", "walking", "waving"]
     is_gs: bool = False
     opacity_threshold: float = 0.0
@@ -32,22 +67,45 @@ class AnimationRequest(BaseModel):
     retarget: bool = True
     inplace: bool = True
 
-def create_app(env: str):
+class AnimationRequest(AnimationOptions):
+    mesh_b64_str: str
+
+def _digest_file(f, chunk_size=4 * 1024 * 1024):
+    """Returns the blake2b digest of a binary file object, leaving it rewound."""
+    f.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    while chunk := f.read(chunk_size):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+def create_app(env: str, router_workers: int = 1):
     """
     Factory function to create and configure the FastAPI application.
     This allows dynamic configuration based on the environment.
+    router_workers is the number of router processes sharing the result cache budget.
     """
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # One long-lived client so keep-alive connections to the workers are reused
+        app.state.http_client = httpx.AsyncClient(limits=WORKER_CONNECTION_LIMITS, timeout=WORKER_TIMEOUT)
+        await probe_workers(app.state.http_client)
+        reprobe_task = asyncio.create_task(reprobe_workers(app.state.http_client))
+        try:
+            yield
+        finally:
+            reprobe_task.cancel()
+            await app.state.http_client.aclose()
+
     app = FastAPI(
+        lifespan=lifespan,
         title="Animation Request Router",
         description="A FastAPI server that acts as a load balancer, routing animation requests to a pool of worker servers.",
         version="1.0.0",
     )
 
     # Define worker ports based on the environment
-    if env == "dev":
-        worker_ports = [8001, 8002, 8003]
-    else: # prod
-        worker_ports = [9001, 9002, 9003]
+    worker_ports = CONFIG_MAPPING[env]["worker_ports"]
 
     # Populate the list of worker servers
     worker_servers_list = [f"http://localhost:{p}" for p in worker_ports]
@@ -59,58 +117,400 @@ def create_app(env: str):
 
     # Store necessary state on the app instance
     app.state.worker_servers = worker_servers_list
-    app.state.server_cycle = itertools.cycle(worker_servers_list)
+    app.state.rr_counter = itertools.count()
+    app.state.inflight = [0] * len(worker_servers_list)
+    app.state.worker_state = [
+        {"healthy": True, "cooldown_until": 0.0, "fails": 0} for _ in worker_servers_list
+    ]
+    # LRU of cache key -> (body, media_type, headers), and the requests still running
+    app.state.result_cache = collections.OrderedDict()
+    app.state.result_cache_bytes = 0
+    app.state.pending_results = {}
+    router_workers = max(1, router_workers)
+    app.state.result_cache_max_entries = max(1, RESULT_CACHE_MAX_ENTRIES // router_workers)
+    app.state.result_cache_max_bytes = RESULT_CACHE_MAX_BYTES // router_workers
 
     print(f"🚀 Configuring Animation Router for '{env.upper()}' environment...")
     print(f"   - Routing requests to: {app.state.worker_servers}")
 
-    @app.post("/animate")
-    async def route_animation_request(payload: AnimationRequest, request: Request):
+    def mark_worker_failed(index):
+        """Takes a worker out of rotation, backing off exponentially on repeated failures."""
+        state = app.state.worker_state[index]
+        state["fails"] += 1
+        state["healthy"] = False
+        state["cooldown_until"] = time.monotonic() + min(WORKER_MAX_COOLDOWN, 2 ** state["fails"])
+
+    def mark_worker_healthy(index):
+        """Puts a worker back into rotation and resets its backoff."""
+        state = app.state.worker_state[index]
+        if not state["healthy"]:
+            print(f"   ✅ Worker {app.state.worker_servers[index]} is healthy again.")
+        state.update(healthy=True, cooldown_until=0.0, fails=0)
+
+    async def probe_workers(client, indices=None):
         """
-        Receives an animation request, forwards it to the next available worker
-        server using a round-robin strategy, and streams the worker's response back.
+        Checks the /health endpoint of the given workers (all by default)
+        concurrently, putting responsive ones back into rotation and backing off
+        the ones that do not answer, so requests are not sent to dead ports.
         """
-        # Access the server_cycle from app.state
-        worker_url = next(app.state.server_cycle)
-        forward_url = f"{worker_url}/animate"
+        if indices is None:
+            indices = range(len(app.state.worker_servers))
+        indices = list(indices)
+        results = await asyncio.gather(
+            *[client.get(f"{app.state.worker_servers[i]}/health", timeout=HEALTH_PROBE_TIMEOUT) for i in indices],
+            return_exceptions=True,
+        )
+        for index, result in zip(indices, results):
+            if isinstance(result, httpx.Response) and result.is_success:
+                mark_worker_healthy(index)
+            else:
+                was_healthy = app.state.worker_state[index]["healthy"]
+                mark_worker_failed(index)
+                if was_healthy:
+                    print(f"   ⚠️ Worker {app.state.worker_servers[index]} did not pass its health check; skipping it for now.")
 
-        print(f"Routing request to worker: {forward_url}")
+    async def reprobe_workers(client):
+        """Background loop that periodically re-probes the workers currently out of rotation."""
+        while True:
+            await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+            unhealthy = [i for i, state in enumerate(app.state.worker_state) if not state["healthy"]]
+            if unhealthy:
+                try:
+                    await probe_workers(client, unhealthy)
+                except Exception as e:
+                    print(f"⚠️ Background health probe failed: {e}")
 
-        # Extract relevant headers to forward for authentication.
-        headers_to_forward = {
-            "Content-Type": "application/json",
-        }
+    def pick_worker(exclude):
+        """
+        Picks the healthy worker with the fewest in-flight requests, breaking ties
+        in round-robin order. Returns the worker index, or None if every worker
+        is excluded or cooling down after a connection failure.
+        """
+        workers = app.state.worker_servers
+        start = next(app.state.rr_counter) % len(workers)
+        now = time.monotonic()
+        candidates = [
+            (start + offset) % len(workers)
+            for offset in range(len(workers))
+            if (start + offset) % len(workers) not in exclude
+            and app.state.worker_state[(start + offset) % len(workers)]["cooldown_until"] <= now
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda i: app.state.inflight[i])
+
+    def auth_headers(request):
+        """Extracts the authentication headers to forward to the worker."""
+        headers = {}
         if "authorization" in request.headers:
-            headers_to_forward["Authorization"] = request.headers["authorization"]
+            headers["Authorization"] = request.headers["authorization"]
         if "x-api-key" in request.headers:
-            headers_to_forward["x-api-key"] = request.headers["x-api-key"]
+            headers["x-api-key"] = request.headers["x-api-key"]
+        return headers
+
+    def result_cache_key(mesh_digest, options_json, headers_to_forward):
+        """
+        Builds the cache key for a request: a digest of the mesh, the remaining
+        options, and the caller's credentials so a cached result is only served to
+        callers the worker has already authenticated.
+        """
+        credentials = hashlib.blake2b(
+            f"{headers_to_forward.get('Authorization', '')}\n{headers_to_forward.get('x-api-key', '')}".encode(),
+            digest_size=16,
+        ).hexdigest()
+        return mesh_digest, options_json, credentials
+
+    def cache_lookup(key):
+        """Returns a Response for a cached result, or None on a miss."""
+        entry = app.state.result_cache.get(key)
+        if entry is None:
+            return None
+        app.state.result_cache.move_to_end(key)
+        body, media_type, headers = entry
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    def cache_store(key, body, media_type, headers):
+        """Stores a result, evicting the least recently used ones to stay within bounds."""
+        if len(body) > app.state.result_cache_max_bytes:
+            return
+        cache = app.state.result_cache
+        if key in cache:
+            app.state.result_cache_bytes -= len(cache.pop(key)[0])
+        cache[key] = (body, media_type, headers)
+        app.state.result_cache_bytes += len(body)
+        while (
+            len(cache) > app.state.result_cache_max_entries
+            or app.state.result_cache_bytes > app.state.result_cache_max_bytes
+        ):
+            _, (evicted_body, _, _) = cache.popitem(last=False)
+            app.state.result_cache_bytes -= len(evicted_body)
+
+    @app.post("/animate")
+    async def route_animation_request(payload: AnimationRequest, request: Request):
+        """
+        Receives an animation request, forwards it to the least-loaded healthy worker
+        server, and streams the worker's response back. Workers that refuse the
+        connection are skipped for a cooldown and the request is retried elsewhere.
+        Repeated requests are answered from the result cache, and identical
+        concurrent requests wait for the first one instead of being forwarded again.
+        """
+        headers_to_forward = {"Content-Type": "application/json", **auth_headers(request)}
+        mesh_digest = hashlib.blake2b(payload.mesh_b64_str.encode(), digest_size=16).hexdigest()
+        cache_key = result_cache_key(
+            mesh_digest, payload.model_dump_json(exclude={"mesh_b64_str"}), headers_to_forward
+        )
+        # Serialize once with pydantic's Rust encoder instead of dict + stdlib json
+        body = payload.model_dump_json().encode()
+        return await serve_request("/animate", lambda: {"content": body}, headers_to_forward, cache_key)
+
+    @app.post("/animate_binary")
+    async def route_animation_binary_request(
+        request: Request,
+        mesh: UploadFile = File(...),
+        metadata: str = Form(...),
+    ):
+        """
+        Same as /animate, but the mesh arrives as a raw multipart file and the other
+        options as a JSON `metadata` form field, so no base64 is involved. The file
+        is streamed through to the worker's /animate_binary endpoint.
+        """
+        try:
+            options = AnimationOptions.model_validate_json(metadata)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+        return await serve_upload(request, mesh, options)
+
+    @app.post("/animate_raw")
+    async def route_animation_raw_request(
+        request: Request,
+        mesh: UploadFile = File(...),
+        animation_name: str = Form(...),
+    ):
+        """
+        Like /animate_binary for clients that only choose the animation: the name is
+        a plain form field and every other option keeps its default.
+        """
+        try:
+            options = AnimationOptions(animation_name=animation_name)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+        return await serve_upload(request, mesh, options)
+
+    @app.post("/animate_stream")
+    async def route_animation_stream_request(request: Request, metadata: str):
+        """
+        Same as /animate, but the body is the base64 mesh on its own and the other
+        options a JSON `metadata` query parameter. The body is spooled once so it
+        can be replayed to another worker on retry, then streamed to the worker's
+        /animate_stream endpoint. It shares result cache entries with /animate.
+        """
+        try:
+            options = AnimationOptions.model_validate_json(metadata)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+
+        spool = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_MAX_MEMORY)
+        try:
+            mesh_digest = hashlib.blake2b(digest_size=16)
+            async for chunk in request.stream():
+                mesh_digest.update(chunk)
+                spool.write(chunk)
+            body_size = spool.tell()
+
+            headers_to_forward = {
+                "Content-Type": "text/plain",
+                "Content-Length": str(body_size),
+                **auth_headers(request),
+            }
+            options_json = options.model_dump_json()
+            cache_key = result_cache_key(mesh_digest.hexdigest(), options_json, headers_to_forward)
+
+            async def spooled_body():
+                # Rewind in case a previous attempt already started reading the spool
+                spool.seek(0)
+                while chunk := spool.read(1024 * 1024):
+                    yield chunk
+
+            def stream_body():
+                return {"content": spooled_body(), "params": {"metadata": options_json}}
+
+            # The request body has been fully sent by the time a response is returned
+            return await serve_request("/animate_stream", stream_body, headers_to_forward, cache_key)
+        finally:
+            spool.close()
+
+    async def serve_upload(request, mesh, options):
+        """
+        Streams an uploaded mesh and its validated options to a worker's
+        /animate_binary endpoint.
+        """
+        headers_to_forward = auth_headers(request)
+        mesh_digest = await run_in_threadpool(_digest_file, mesh.file)
+        options_json = options.model_dump_json()
+        cache_key = result_cache_key(mesh_digest, options_json, headers_to_forward)
+
+        def multipart_body():
+            # Rewind in case a previous attempt already started reading the file
+            mesh.file.seek(0)
+            return {
+                "files": {"mesh": (mesh.filename or "mesh", mesh.file, mesh.content_type or "application/octet-stream")},
+                "data": {"metadata": options_json},
+            }
 
-        # Asynchronously forward the request to the selected worker
-        async with httpx.AsyncClient() as client:
+        return await serve_request("/animate_binary", multipart_body, headers_to_forward, cache_key)
+
+    async def serve_request(path, make_body, headers_to_forward, cache_key):
+        """
+        Answers from the result cache when possible, joins an identical request that
+        is already in flight, and otherwise forwards the request to a worker.
+        """
+        cached = cache_lookup(cache_key)
+        if cached is not None:
+            print("Serving request from the result cache")
+            return cached
+
+        pending = app.state.pending_results.get(cache_key)
+        if pending is not None:
+            # An identical request is already running; reuse its result if it succeeds
             try:
-                response = await client.post(
-                    url=forward_url,
-                    json=payload.model_dump(),
-                    headers=headers_to_forward,
-                    timeout=WORKER_TIMEOUT,
-                )
-                response.raise_for_status()
+                await asyncio.wait_for(pending.wait(), timeout=WORKER_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            cached = cache_lookup(cache_key)
+            if cached is not None:
+                print("Serving deduplicated request from the result cache")
+                return cached
+            return await forward_request(path, make_body, headers_to_forward, cache_key, None)
+
+        done = asyncio.Event()
+        app.state.pending_results[cache_key] = done
+
+        def finish():
+            if app.state.pending_results.get(cache_key) is done:
+                del app.state.pending_results[cache_key]
+            done.set()
+
+        try:
+            return await forward_request(path, make_body, headers_to_forward, cache_key, finish)
+        except BaseException:
+            finish()
+            raise
+
+    async def forward_request(path, make_body, headers_to_forward, cache_key, finish):
+        """
+        Forwards the request to `path` on a worker and returns a streaming response
+        over its body. `make_body` returns the httpx body arguments for each attempt.
+        A complete successful body is stored in the result cache; `finish` (if given)
+        is called once the outcome is known.
+        """
+        client = app.state.http_client
+        tried = set()
+        connect_errors = []
+        while True:
+            worker_index = pick_worker(tried)
+            if worker_index is None:
+                error_message = "No worker server is available. " + " ".join(connect_errors)
+                print(error_message)
+                raise HTTPException(status_code=503, detail=error_message.strip())
+            tried.add(worker_index)
+            worker_url = app.state.worker_servers[worker_index]
+            forward_url = f"{worker_url}{path}"
+
+            print(f"Routing request to worker: {forward_url}")
+
+            # Asynchronously forward the request to the selected worker and stream
+            # its response body back without buffering or re-encoding it here
+            upstream_request = client.build_request(
+                "POST",
+                url=forward_url,
+                headers=headers_to_forward,
+                timeout=WORKER_TIMEOUT,
+                **make_body(),
+            )
+            app.state.inflight[worker_index] += 1
+            try:
+                upstream = await client.send(upstream_request, stream=True)
+                mark_worker_healthy(worker_index)
+                break
             except httpx.ConnectError as e:
+                app.state.inflight[worker_index] -= 1
+                mark_worker_failed(worker_index)
                 error_message = f"Could not connect to worker server at {worker_url}. The service may be down. Error: {e}"
                 print(error_message)
-                raise HTTPException(status_code=503, detail=error_message)
+                connect_errors.append(error_message)
             except httpx.ReadTimeout as e:
+                app.state.inflight[worker_index] -= 1
                 error_message = f"Request to worker server at {worker_url} timed out after {WORKER_TIMEOUT} seconds. Error: {e}"
                 print(error_message)
                 raise HTTPException(status_code=504, detail=error_message)
-            except httpx.HTTPStatusError as e:
-                worker_response_body = e.response.json()
-                raise HTTPException(
-                    status_code=e.response.status_code,
-                    detail=worker_response_body.get("detail", "An unknown error occurred on the worker server."),
-                )
+            except BaseException:
+                app.state.inflight[worker_index] -= 1
+                raise
+
+        released = False
 
-        return JSONResponse(content=response.json(), status_code=response.status_code)
+        async def release():
+            # Runs from the relay's cleanup and as a background task; only the first call counts
+            nonlocal released
+            if released:
+                return
+            released = True
+            app.state.inflight[worker_index] -= 1
+            if finish is not None:
+                finish()
+            await upstream.aclose()
+
+        if upstream.is_error:
+            # Only error bodies are read in full, to extract the worker's detail message
+            try:
+                await upstream.aread()
+                worker_response_body = upstream.json()
+            except ValueError:
+                worker_response_body = {}
+            finally:
+                await release()
+            raise HTTPException(
+                status_code=upstream.status_code,
+                detail=worker_response_body.get("detail", "An unknown error occurred on the worker server."),
+            )
+
+        # Raw bytes are passed through, so keep the worker's content encoding
+        passthrough_headers = {}
+        if "content-encoding" in upstream.headers:
+            passthrough_headers["Content-Encoding"] = upstream.headers["content-encoding"]
+        media_type = upstream.headers.get("content-type")
+
+        # Only buffer bodies that can fit in the cache; larger ones are streamed through as-is
+        cache_budget = app.state.result_cache_max_bytes
+        try:
+            declared_length = int(upstream.headers.get("content-length", 0))
+        except ValueError:
+            declared_length = 0
+
+        async def relay():
+            chunks = [] if declared_length <= cache_budget else None
+            buffered_bytes = 0
+            try:
+                async for chunk in upstream.aiter_raw():
+                    if chunks is not None:
+                        buffered_bytes += len(chunk)
+                        if buffered_bytes > cache_budget:
+                            chunks = None
+                        else:
+                            chunks.append(chunk)
+                    yield chunk
+                if chunks is not None:
+                    cache_store(cache_key, b"".join(chunks), media_type, passthrough_headers)
+            finally:
+                await release()
+
+        return StreamingResponse(
+            relay(),
+            status_code=upstream.status_code,
+            headers=passthrough_headers,
+            media_type=media_type,
+            background=BackgroundTask(release),
+        )
 
     @app.get("/health", summary="Health Check")
     def health_check():
@@ -124,15 +524,39 @@ def create_app(env: str):
     return app
 
 
+def create_app_from_env():
+    """
+    App factory for uvicorn worker processes, which cannot receive arguments
+    directly; the environment name and process count are read from
+    ROUTER_ENV and ROUTER_WORKERS instead.
+    """
+    return create_app(os.environ[ROUTER_ENV_VAR], int(os.environ.get(ROUTER_WORKERS_VAR, 1)))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the Animation Router.")
     parser.add_argument("--port", type=int, required=True, help="Port to run the router on.")
     parser.add_argument("--env", type=str, choices=["dev", "prod"], required=True, help="Environment to configure for ('dev' or 'prod').")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Number of router processes. Load tracking is per process and the result cache budget is split between them.")
+    parser.add_argument("--limit-concurrency", type=int, default=256, help="Maximum concurrent connections per process before new ones get a 503.")
     args = parser.parse_args()
-    
-    # Create the app instance with the specified environment
-    # The 'app_instance' object here is the one that Uvicorn will run
-    app_instance = create_app(args.env)
 
-    print(f"   - Listening on http://0.0.0.0:{args.port}")
-    uvicorn.run(app_instance, host="0.0.0.0", port=args.port, reload=False)
\ No newline at end of file
+    # Worker processes build their own app through the factory, so pass the
+    # environment down to them instead of creating the app here
+    os.environ[ROUTER_ENV_VAR] = args.env
+    os.environ[ROUTER_WORKERS_VAR] = str(args.workers)
+
+    print(f"   - Listening on http://0.0.0.0:{args.port} with {args.workers} worker process(es)")
+    uvicorn.run(
+        "router:create_app_from_env",
+        factory=True,
+        host="0.0.0.0",
+        port=args.port,
+        reload=False,
+        workers=args.workers,
+        # "auto" picks uvloop and httptools whenever they are installed
+        loop="auto",
+        http="auto",
+        backlog=4096,
+        limit_concurrency=args.limit_concurrency,
+    )
@@ -1,23 +1,73 @@
 import os
 import sys
+import asyncio
+import functools
 import tempfile
 import base64
+import binascii
 import shutil
 import logging
 import pickle
+import mmap
+import hashlib
+from collections import OrderedDict
 from pathlib import Path
 from contextlib import asynccontextmanager
-from typing import List, Optional, Literal
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Literal, Union, get_args
 
 # Third-party imports
 import httpx
 import anthropic
 from aiocache import cached, Cache
-from pydantic import BaseModel, Field
-from fastapi import FastAPI, HTTPException, Header, Depends
-from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, ValidationError
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    Header,
+    Depends,
+    UploadFile,
+    File,
+    Form,
+    Query,
+    Request,
+    BackgroundTasks,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from azure.storage.blob import BlobServiceClient, BlobClient
+from azure.storage.blob.aio import BlobServiceClient
+
+try:
+    # SIMD base64; several times faster than the stdlib on large GLBs
+    import pybase64 as b64
+except ImportError:
+    b64 = base64
+
+try:
+    # ~20 GB/s non-cryptographic hash for response cache keys
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    # safe, fast serialisation for the animation DB; pickle is the legacy format
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    # ORJSONResponse needs orjson; it serialises the multi-MB base64 strings ~10x faster
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as AnimationResponse
+except ImportError:
+    AnimationResponse = JSONResponse
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
 
 SERVER_ROOT = Path(__file__).parent  # This is now /project/server/
 AZURE_CONNECTION_STRING = (
@@ -27,11 +77,26 @@ AZURE_CONNECTION_STRING = (
 )
 ANTHROPIC_API_KEY = "xxxxxx"
 AZURE_CONTAINER_NAME = "fbx-animation-files"
+# parallel ranged GETs for blob downloads; FBX assets are large enough to benefit
+BLOB_DOWNLOAD_CONCURRENCY = 16
+BLOB_MAX_CHUNK_GET_SIZE = 16 * 1024 * 1024
+# motion FBXs are mostly well under this, so they come back in a single GET
+BLOB_MAX_SINGLE_GET_SIZE = 64 * 1024 * 1024
+# prompts are matched to animation names by embedding similarity first; the
+# LLM is only asked when nothing scores at least MOTION_MATCH_MIN_SIMILARITY
+MOTION_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+MOTION_MATCH_MIN_SIMILARITY = 0.35
+# animation clips the pipeline retargets onto the mesh; copied to RAM-backed
+# tmpfs at startup so requests never wait on a cold disk read
+ANIMATION_SOURCE_DIR = Path("/home/ray/csm/models/make_it_animatable/data")
+ANIMATION_STAGE_DIR = Path("/dev/shm/mia_anims")
 
 # ---- import the core Make-It-Animatable code --------------------
 # PARENT_DIR will be /project/
 PARENT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-sys.path.append(PARENT_DIR)
+# first on the path so `app`/`util` resolve without scanning site-packages first
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
 import app as mia  # our Gradio-based pipeline functions
 
 from app import (
@@ -45,13 +110,13 @@ from app import (
 )
 
 # ---- NEW: Import the blender utility directly -------------------
-from util import blender_join_and_save, render_glb_frames, render_thumbnail
+from util import blender_join_and_save, render_glb_frames
 
 # -----------------------------------------------------------------
 
 
 # ensure the module attributes don't shadow our placeholders
-for _name in [
+_PLACEHOLDER_NAMES = (
     "state",
     "output_joints_coarse",
     "output_normed_input",
@@ -62,41 +127,120 @@ for _name in [
     "output_rest_lbs",
     "output_anim",
     "output_anim_vis",
-]:
-    setattr(mia, _name, _name)
+)
+vars(mia).update(zip(_PLACEHOLDER_NAMES, _PLACEHOLDER_NAMES))
+
+# -----------------------------------------------------------------
+#  Shared clients: one connection pool each for the process lifetime,
+#  closed in the lifespan shutdown
+# -----------------------------------------------------------------
+ANTHROPIC_CLIENT = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+HTTPX_CLIENT = httpx.AsyncClient(
+    timeout=10.0, limits=httpx.Limits(max_keepalive_connections=32)
+)
+BLOB_SERVICE_CLIENT = BlobServiceClient.from_connection_string(
+    AZURE_CONNECTION_STRING,
+    max_single_get_size=BLOB_MAX_SINGLE_GET_SIZE,
+    max_chunk_get_size=BLOB_MAX_CHUNK_GET_SIZE,
+)
 
 # -----------------------------------------------------------------
 #  Global animation lookup
 # -----------------------------------------------------------------
 ANIMATION_DB = {}
 
+# Finished responses keyed on (mesh digest, animation name), so re-running the
+# same combination skips the pipeline entirely. In memory only: a restart is
+# also the only way new model checkpoints get loaded, so entries never outlive
+# the weights that produced them.
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.getenv("MIA_RESPONSE_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+)
+
+# animation name -> FBX the pipeline reads for it, resolved once in the lifespan
+ANIMATION_PATHS = {}
+
+# Loaded in the lifespan when sentence-transformers is installed
+MOTION_ENCODER = None
+# hash(animation listing) -> normalised name embeddings for that listing
+_MOTION_NAME_EMBEDDINGS = {}
+
+# The pipeline is CPU/GPU-bound for tens of seconds, so it runs here instead of
+# on the event loop. Each worker process owns one GPU (CUDA_VISIBLE_DEVICES is
+# set by launch_servers.py), so by default one pipeline runs at a time and
+# further requests queue on the pool rather than thrashing VRAM.
+PIPELINE_CONCURRENCY = int(os.getenv("MIA_PIPELINE_CONCURRENCY", "1"))
+PIPELINE_POOL = ThreadPoolExecutor(
+    max_workers=PIPELINE_CONCURRENCY, thread_name_prefix="mia-pipeline"
+)
+# bpy has a single global scene that is neither thread-safe nor shareable, so
+# all Blender work (rigging in vis_blender, thumbnail and GIF renders) runs in
+# these long-lived processes; each keeps bpy imported between requests instead
+# of paying Blender's cold start every call. The pool lives in app (mia) so
+# vis_blender, which runs on a pipeline thread, and the renders below share it
+# and both see the same rebuild after a crash.
+BLENDER_POOL_WORKERS = 2
+# Blender processes each server render is split across. Renders already run
+# in the pool workers above, so the default of 1 keeps it at one Blender per
+# worker instead of fanning out into more shard subprocesses per request;
+# raise MIA_SERVER_RENDER_SHARDS only on hosts with cores to spare.
+SERVER_RENDER_SHARDS = int(os.getenv("MIA_SERVER_RENDER_SHARDS", "1"))
+mia.enable_blender_pool(BLENDER_POOL_WORKERS)
+
 
 # -----------------------------------------------------------------
 #  Lifespan: initialise models once at startup
 # -----------------------------------------------------------------
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global MOTION_ENCODER
     # load or scan animation DB
-    animation_pkl = "animation.pkl"
-    loaded = False
-    if os.path.exists(animation_pkl):
+    animation_msgpack = "animation.msgpack"
+    animation_pkl = "animation.pkl"  # legacy format, only read when no msgpack DB exists
+    data_mtime = os.stat("./data").st_mtime if os.path.isdir("./data") else 0.0
+    loaded_from = None
+    if msgpack is not None and os.path.exists(animation_msgpack):
+        if os.path.getmtime(animation_msgpack) >= data_mtime:
+            try:
+                ANIMATION_DB.update(
+                    msgpack.unpackb(Path(animation_msgpack).read_bytes(), raw=False)
+                )
+                loaded_from = animation_msgpack
+                print(f"✅ Loaded {len(ANIMATION_DB)} animations from {animation_msgpack}")
+            except Exception as e:
+                print(f"❌ Failed to load msgpack DB: {e}")
+        else:
+            print(f"⚠️ {animation_msgpack} is older than ./data, rescanning")
+    elif os.path.exists(animation_pkl):
         try:
             with open(animation_pkl, "rb") as f:
                 ANIMATION_DB.update(pickle.load(f))
-            loaded = True
+            loaded_from = animation_pkl
             print(f"✅ Loaded {len(ANIMATION_DB)} animations from {animation_pkl}")
         except Exception as e:
             print(f"❌ Failed to load pickle DB: {e}")
 
-    if not loaded and os.path.isdir("./data"):
-        for idx, fname in enumerate(os.listdir("./data")):
-            if fname.lower().endswith(".fbx"):
+    if loaded_from is None and os.path.isdir("./data"):
+        with os.scandir("./data") as it:
+            # scandir's cached dirent type avoids a stat per file
+            fbx_entries = (
+                e for e in it if e.is_file() and e.name.lower().endswith(".fbx")
+            )
+            for idx, entry in enumerate(fbx_entries):
                 ANIMATION_DB[f"motion_{idx}"] = {
-                    "file_path": os.path.join("./data", fname),
-                    "name": Path(fname).stem,
+                    "file_path": entry.path,
+                    "name": Path(entry.name).stem,
                 }
         print(f"✅ Scanned {len(ANIMATION_DB)} .fbx files in ./data")
 
+    if msgpack is not None and loaded_from != animation_msgpack and ANIMATION_DB:
+        # persist scans (and migrate legacy pickles) so the next start skips them
+        try:
+            Path(animation_msgpack).write_bytes(msgpack.packb(ANIMATION_DB))
+            print(f"✅ Saved {len(ANIMATION_DB)} animations to {animation_msgpack}")
+        except Exception as e:
+            print(f"❌ Failed to save msgpack DB: {e}")
+
     if not ANIMATION_DB and os.path.exists("./data/Standard Run.fbx"):
         ANIMATION_DB["default"] = {
             "file_path": "./data/Standard Run.fbx",
@@ -106,7 +250,30 @@ async def lifespan(app: FastAPI):
 
     init_models()
     print("✅ Make-It-Animatable models initialised")
+
+    try:
+        staged = _stage_animation_files()
+        print(f"✅ Staged {staged} animation files in {ANIMATION_STAGE_DIR}")
+    except OSError as e:
+        print(f"❌ Failed to stage animation files, reading from disk: {e}")
+    ANIMATION_PATHS.update(_build_animation_paths())
+    missing = sorted(set(get_args(AnimationName)) - ANIMATION_PATHS.keys())
+    if missing:
+        print(f"❌ No animation file found for: {', '.join(missing)}")
+
+    if SentenceTransformer is not None:
+        try:
+            # small enough for CPU; keeps the GPU to the pipeline
+            MOTION_ENCODER = SentenceTransformer(MOTION_EMBEDDING_MODEL, device="cpu")
+            print(f"✅ Loaded motion matching encoder {MOTION_EMBEDDING_MODEL}")
+        except Exception as e:
+            print(f"❌ Failed to load motion matching encoder, using the LLM only: {e}")
     yield
+    PIPELINE_POOL.shutdown(wait=False, cancel_futures=True)
+    mia.shutdown_blender_pool()
+    await HTTPX_CLIENT.aclose()
+    await ANTHROPIC_CLIENT.close()
+    await BLOB_SERVICE_CLIENT.close()
 
 
 app = FastAPI(
@@ -115,6 +282,7 @@ app = FastAPI(
     docs_url=None,
     redoc_url=None,
     openapi_url=None,
+    default_response_class=AnimationResponse,
 )
 
 app.add_middleware(
@@ -126,9 +294,11 @@ app.add_middleware(
 )
 
 
-class AnimationRequest(BaseModel):
-    mesh_b64_str: str
-    animation_name: Literal["running", "jumping", "punching", "walking", "waving"]
+AnimationName = Literal["running", "jumping", "punching", "walking", "waving"]
+
+
+class AnimationOptions(BaseModel):
+    animation_name: AnimationName
     is_gs: bool = False
     opacity_threshold: float = 0.0
     no_fingers: bool = False
@@ -145,84 +315,203 @@ class AnimationRequest(BaseModel):
     inplace: bool = True
 
 
-# This function remains unchanged
-def download_blob_to_temp_file(blob_url: str) -> str:
-    blob_name = blob_url.split(f"{AZURE_CONTAINER_NAME}/")[-1]
-    blob_client = BlobClient.from_connection_string(
-        conn_str=AZURE_CONNECTION_STRING,
-        container_name=AZURE_CONTAINER_NAME,
-        blob_name=blob_name,
-    )
-    temp_f = tempfile.NamedTemporaryFile(suffix=".fbx", delete=False)
-    with temp_f as f:
-        download_stream = blob_client.download_blob()
-        f.write(download_stream.readall())
-    return temp_f.name
+class AnimationRequest(AnimationOptions):
+    mesh_b64_str: str
 
 
-# This function remains unchanged
-def find_best_motion_match(text_prompt: str) -> str:
-    # (Function content is unchanged)
+def _pwrite_all(fd: int, data: bytes, offset: int):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view, offset = view[written:], offset + written
+
+
+class _ThreadedFileWriter:
+    """
+    Seekable stream for the SDK's parallel readinto whose writes run as
+    positional writes on worker threads, so disk I/O never blocks the event
+    loop. Call drain() before closing the file.
+    """
+
+    def __init__(self, fd: int):
+        self._fd = fd
+        self._pos = 0
+        self._pending = set()
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence != os.SEEK_SET:
+            raise ValueError("Only absolute seeks are supported")
+        self._pos = offset
+        return self._pos
+
+    def write(self, data: bytes) -> int:
+        task = asyncio.ensure_future(asyncio.to_thread(_pwrite_all, self._fd, data, self._pos))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        self._pos += len(data)
+        return len(data)
+
+    async def drain(self, return_exceptions: bool = False):
+        await asyncio.gather(*self._pending, return_exceptions=return_exceptions)
+
+
+async def _download_blob_into(blob_name: str, fd: int):
+    """
+    Streams a blob into an open file in parallel ranged GETs; readinto means
+    nothing holds the whole blob, and the writes happen off the event loop.
+    """
+    blob_client = BLOB_SERVICE_CLIENT.get_blob_client(AZURE_CONTAINER_NAME, blob_name)
+    writer = _ThreadedFileWriter(fd)
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(
-            AZURE_CONNECTION_STRING
-        )
-        container_client = blob_service_client.get_container_client(
-            AZURE_CONTAINER_NAME
+        download_stream = await blob_client.download_blob(
+            max_concurrency=BLOB_DOWNLOAD_CONCURRENCY
         )
-        blob_list = container_client.list_blobs()
-        animation_files = [b.name for b in blob_list if b.name.lower().endswith(".fbx")]
-        if not animation_files:
-            raise HTTPException(500, "No animation files in Azure.")
+        await download_stream.readinto(writer)
+    except BaseException:
+        # Let in-flight writes finish before the caller drops the file
+        await writer.drain(return_exceptions=True)
+        raise
+    await writer.drain()
+
+
+async def download_blob_to_temp_file(blob_url: str) -> str:
+    blob_name = blob_url.split(f"{AZURE_CONTAINER_NAME}/")[-1]
+    fd, temp_path = tempfile.mkstemp(suffix=".fbx")
+    try:
+        await _download_blob_into(blob_name, fd)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    finally:
+        os.close(fd)
+    return temp_path
+
+
+@cached(ttl=300, cache=Cache.MEMORY)
+async def _list_animation_blobs() -> tuple:
+    """Names of the .fbx blobs in the animation container, re-listed every 5 minutes."""
+    container_client = BLOB_SERVICE_CLIENT.get_container_client(AZURE_CONTAINER_NAME)
+    animation_files = [
+        b.name
+        async for b in container_client.list_blobs()
+        if b.name.lower().endswith(".fbx")
+    ]
+    return tuple(animation_files)
+
+
+def _motion_match_key(func, text_prompt: str, animation_files: tuple) -> str:
+    # the listing is part of the key so a changed container invalidates old picks
+    return f"{func.__name__}:{hash(animation_files)}:{text_prompt.lower().strip()}"
+
+
+def _embedding_match(text_prompt: str, animation_files: tuple) -> Optional[str]:
+    """
+    Picks the animation whose name is nearest to the prompt by cosine
+    similarity, or None if no encoder is loaded or nothing is close enough.
+    """
+    if MOTION_ENCODER is None:
+        return None
+    key = hash(animation_files)
+    name_embs = _MOTION_NAME_EMBEDDINGS.get(key)
+    if name_embs is None:
+        names = [Path(n).stem.replace("_", " ") for n in animation_files]
+        name_embs = MOTION_ENCODER.encode(names, normalize_embeddings=True)
+        # only the current listing is ever queried
+        _MOTION_NAME_EMBEDDINGS.clear()
+        _MOTION_NAME_EMBEDDINGS[key] = name_embs
+    query = MOTION_ENCODER.encode([text_prompt], normalize_embeddings=True)[0]
+    scores = name_embs @ query
+    best = int(scores.argmax())
+    if scores[best] < MOTION_MATCH_MIN_SIMILARITY:
+        return None
+    return animation_files[best]
+
+
+@cached(ttl=3600, cache=Cache.MEMORY, key_builder=_motion_match_key)
+async def _choose_animation_blob(text_prompt: str, animation_files: tuple) -> str:
+    match = await run_in_threadpool(_embedding_match, text_prompt, animation_files)
+    if match is not None:
+        return match
+
+    animation_db = {Path(n).stem: n for n in animation_files}
+
+    def fallback(prompt):
+        p = prompt.lower()
+        mapping = [
+            (["run", "jog", "sprint"], "run"),
+            (["walk", "stroll"], "walk"),
+            (["jump", "hop"], "jump"),
+            (["dance", "boogie"], "dance"),
+            (["idle", "stand"], "idle"),
+        ]
+        for keys, key in mapping:
+            if any(k in p for k in keys):
+                for name in animation_db:
+                    if key in name.lower():
+                        return animation_db[name]
+        return animation_files[0]
 
-        animation_db = {Path(n).stem: n for n in animation_files}
-
-        def fallback(prompt):
-            p = prompt.lower()
-            mapping = [
-                (["run", "jog", "sprint"], "run"),
-                (["walk", "stroll"], "walk"),
-                (["jump", "hop"], "jump"),
-                (["dance", "boogie"], "dance"),
-                (["idle", "stand"], "idle"),
-            ]
-            for keys, key in mapping:
-                if any(k in p for k in keys):
-                    for name in animation_db:
-                        if key in name.lower():
-                            return animation_db[name]
-            return animation_files[0]
-
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-        prompt = f"""
-User wants an animation: "{text_prompt}"
-
-Choose the BEST match from:
+    # The animation list is identical across requests, so it goes in a cached
+    # system block and only the user's prompt is sent fresh each time.
+    instructions = f"""
+Choose the BEST match for the animation the user asks for from:
 {', '.join(animation_db.keys())}
 
 Only reply with the name (no extension).
 """
-        msg = client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=100,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        resp = getattr(msg, "content", "")
-        name = str(resp).strip()
-        if name in animation_db:
-            chosen = animation_db[name]
-        else:
-            chosen = next(
-                (animation_db[n] for n in animation_db if name.lower() in n.lower()),
-                fallback(text_prompt),
-            )
+    msg = await ANTHROPIC_CLIENT.messages.create(
+        model="claude-3-haiku-20240307",
+        max_tokens=100,
+        system=[
+            {
+                "type": "text",
+                "text": instructions,
+                "cache_control": {"type": "ephemeral"},
+            }
+        ],
+        messages=[
+            {"role": "user", "content": f'User wants an animation: "{text_prompt}"'}
+        ],
+    )
+    resp = getattr(msg, "content", "")
+    name = str(resp).strip()
+    if name in animation_db:
+        return animation_db[name]
+    return next(
+        (animation_db[n] for n in animation_db if name.lower() in n.lower()),
+        fallback(text_prompt),
+    )
+
+
+async def find_best_motion_match(text_prompt: str) -> str:
+    try:
+        animation_files = await _list_animation_blobs()
+        if not animation_files:
+            raise HTTPException(500, "No animation files in Azure.")
+
+        chosen = await _choose_animation_blob(text_prompt, animation_files)
         local_dir = Path("./data")
         local_dir.mkdir(exist_ok=True)
         local_path = local_dir / Path(chosen).name
         if not local_path.exists():
-            blob_client = container_client.get_blob_client(chosen)
-            with open(local_path, "wb") as f:
-                f.write(blob_client.download_blob().readall())
+            # stream into a sibling temp file and rename, so an interrupted
+            # download never leaves a truncated FBX behind in the local cache
+            fd, part_path = tempfile.mkstemp(dir=local_dir, suffix=".part")
+            try:
+                try:
+                    await _download_blob_into(chosen, fd)
+                finally:
+                    os.close(fd)
+                os.replace(part_path, local_path)
+            except BaseException:
+                os.unlink(part_path)
+                raise
         return str(local_path)
     except Exception as e:
         print(f"Error in find_best_motion_match: {e}")
@@ -237,14 +526,13 @@ async def _fetch_user_data_from_api(header_name: str, header_value: str) -> dict
         "https://api.csm.ai/user/userdata",
         "https://devapi.csm.ai/user/userdata",
     ]
-    async with httpx.AsyncClient() as client:
-        for url in endpoints:
-            try:
-                resp = await client.get(url, headers={header_name: header_value})
-                if resp.status_code == 200:
-                    return resp.json()
-            except httpx.RequestError:
-                continue
+    for url in endpoints:
+        try:
+            resp = await HTTPX_CLIENT.get(url, headers={header_name: header_value})
+            if resp.status_code == 200:
+                return resp.json()
+        except httpx.RequestError:
+            continue
     raise HTTPException(status_code=403, detail="Invalid credentials")
 
 
@@ -268,7 +556,131 @@ async def _verify_api_key(
         raise HTTPException(status_code=500, detail=f"Auth check failed: {e}")
 
 
-# This function remains unchanged
+def _read_file_bytes(path: Union[str, os.PathLike]) -> bytes:
+    """
+    Reads a whole file with a single read sized from fstat, bypassing Python's
+    buffered I/O layer.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        data = os.read(fd, size)
+        if len(data) < size:
+            # Short read (e.g. very large files); finish with the remaining bytes
+            chunks = [data]
+            while True:
+                chunk = os.read(fd, size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            data = b"".join(chunks)
+        return data
+    finally:
+        os.close(fd)
+
+
+def _mesh_digest(mesh: Union[bytes, str, os.PathLike]) -> str:
+    """Hex digest of mesh bytes or of the contents of a mesh file."""
+    hasher = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    if isinstance(mesh, (str, os.PathLike)):
+        with open(mesh, "rb") as f:
+            while chunk := f.read(4 * 1024 * 1024):
+                hasher.update(chunk)
+    else:
+        hasher.update(mesh)
+    return hasher.hexdigest()
+
+
+class ResponseCache:
+    """Byte-bounded LRU of rendered response bodies; only used from the event loop."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        body = self.entries.get(key)
+        if body is not None:
+            self.entries.move_to_end(key)
+        return body
+
+    def put(self, key: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.entries[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+
+
+def _b64_file(path: Union[str, os.PathLike]) -> str:
+    """
+    Base64-encodes a file straight from an mmap of it, so the raw bytes are
+    never copied into a Python buffer first; run off the event loop for large
+    outputs.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return b64.b64encode(mm).decode("ascii")
+
+
+def _detect_mesh_ext(header: bytes) -> str:
+    """
+    Returns the file extension matching the mesh format given its leading bytes.
+    """
+    if header[:4] == b"glTF":
+        return ".glb"
+    elif header.startswith(b"Kaydara FBX"):
+        return ".fbx"
+    raise HTTPException(400, "Unsupported mesh format. Supported: .glb or .fbx")
+
+
+def _prepare_input_file(input_filepath: str, db: DB):
+    """
+    Calls the core prepare_input function on a mesh file that is already on disk.
+    """
+    try:
+        prepare_input(
+            input_path=input_filepath,
+            is_gs=False,
+            opacity_threshold=0.0,
+            db=db,
+            export_temp=False,
+        )
+    except Exception as e:
+        # Catch any exception from the direct call (e.g., ValueError, RuntimeError)
+        error_message = f"Mesh preparation failed: {e}"
+        logging.error(error_message, exc_info=True)
+        raise HTTPException(status_code=500, detail=error_message) from e
+
+
+def _prepare_input_path(mesh_path: Union[str, os.PathLike], db: DB):
+    """
+    Validates a mesh file on disk and prepares it in place, without reading it into memory.
+    """
+    mesh_path = os.fspath(mesh_path)
+    with open(mesh_path, "rb") as f:
+        header = f.read(len(b"Kaydara FBX"))
+    if not header:
+        raise HTTPException(status_code=400, detail=f"Received empty mesh file: {mesh_path}")
+    ext = _detect_mesh_ext(header)
+    if os.path.splitext(mesh_path)[1].lower() != ext:
+        # The loader relies on the extension, so fall back to a correctly named copy
+        _prepare_input_memory(_read_file_bytes(mesh_path), db)
+        return
+    _prepare_input_file(mesh_path, db)
+
+
 def _prepare_input_memory(mesh_bytes: bytes, db: DB):
     """
     Decodes mesh bytes, saves to a temp file, and then calls the core prepare_input function.
@@ -279,47 +691,39 @@ def _prepare_input_memory(mesh_bytes: bytes, db: DB):
             detail="Received empty mesh data. The 'mesh_b64_str' field in the request payload cannot be empty.",
         )
     # Detect file extension from mesh byte data
-    if mesh_bytes[:4] == b"glTF":
-        ext = ".glb"
-    elif mesh_bytes.startswith(b"Kaydara FBX"):
-        ext = ".fbx"
-    else:
-        raise HTTPException(400, "Unsupported mesh format. Supported: .glb or .fbx")
+    ext = _detect_mesh_ext(mesh_bytes)
 
     input_filepath = None
     try:
         # Create temporary input and output paths
+        # Unbuffered: the whole mesh goes out in one write syscall. This runs on
+        # the pipeline thread, so the write never blocks the event loop.
         with tempfile.NamedTemporaryFile(
-            suffix=ext, dir="/dev/shm", delete=False
+            suffix=ext, dir="/dev/shm", delete=False, buffering=0
         ) as tmp_input:
-            tmp_input.write(mesh_bytes)
-            tmp_input.flush()
+            view = memoryview(mesh_bytes)
+            while view:
+                view = view[tmp_input.write(view):]
             input_filepath = tmp_input.name
 
         # Now, call the core `prepare_input` with the Blender-processed file
-        prepare_input(
-            input_path=input_filepath,
-            is_gs=False,
-            opacity_threshold=0.0,
-            db=db,
-            export_temp=False,
-        )
-    except Exception as e:
-        # Catch any exception from the direct call (e.g., ValueError, RuntimeError)
-        error_message = f"Mesh preparation failed: {e}"
-        logging.error(error_message, exc_info=True)
-        raise HTTPException(status_code=500, detail=error_message) from e
+        _prepare_input_file(input_filepath, db)
     finally:
         # Clean up temporary files
         if input_filepath and os.path.exists(input_filepath):
             os.unlink(input_filepath)
 
 
-# This function remains unchanged
-def run_pipeline(mesh_bytes: bytes, animation_name: str) -> DB:
-    # (Function content is unchanged)
+def run_pipeline(mesh: Union[bytes, str, os.PathLike], animation_name: str) -> DB:
+    """
+    Runs the full rigging + animation pipeline. `mesh` is either the raw mesh
+    bytes or the path of a mesh file already on disk, which is used in place.
+    """
     db = DB()
-    _prepare_input_memory(mesh_bytes, db)
+    if isinstance(mesh, (str, os.PathLike)):
+        _prepare_input_path(mesh, db)
+    else:
+        _prepare_input_memory(mesh, db)
     preprocess(db)
     infer(False, db)
     vis(True, "LeftArm", False, db)
@@ -328,9 +732,8 @@ def run_pipeline(mesh_bytes: bytes, animation_name: str) -> DB:
         remove_fingers=False,
         rest_pose_type="",
         ignore_pose_parts=[],
-        animation_file=str(
-            Path("/home/ray/csm/models/make_it_animatable/data")
-            / f"{animation_name}.fbx"
+        animation_file=ANIMATION_PATHS.get(
+            animation_name, str(ANIMATION_SOURCE_DIR / f"{animation_name}.fbx")
         ),
         retarget=True,
         inplace=True,
@@ -339,24 +742,238 @@ def run_pipeline(mesh_bytes: bytes, animation_name: str) -> DB:
     return db
 
 
-@app.post("/animate")
-async def animate(
-    payload: AnimationRequest,
-    _: dict = Depends(_verify_api_key),
-):
-    # Use PARENT_DIR to construct the path to animation-fbx-files
-    animation_file_path = os.path.join(
-        PARENT_DIR, "animation-fbx-files", f"{payload.animation_name}.fbx"
-    )
-    if not os.path.exists(animation_file_path):
+def _stage_animation_files() -> int:
+    """
+    Copies every known animation clip into ANIMATION_STAGE_DIR, skipping clips
+    already staged by a previous start or another worker on this host, and
+    returns how many are available there.
+    """
+    ANIMATION_STAGE_DIR.mkdir(parents=True, exist_ok=True)
+    staged = 0
+    for name in get_args(AnimationName):
+        src = ANIMATION_SOURCE_DIR / f"{name}.fbx"
+        dst = ANIMATION_STAGE_DIR / f"{name}.fbx"
+        if not src.is_file():
+            continue
+        src_stat = src.stat()
+        if dst.is_file():
+            dst_stat = dst.stat()
+            if (dst_stat.st_size, dst_stat.st_mtime) == (src_stat.st_size, src_stat.st_mtime):
+                staged += 1
+                continue
+        # copy under a unique name and rename, since workers start concurrently
+        fd, part_path = tempfile.mkstemp(dir=ANIMATION_STAGE_DIR, suffix=".part")
+        os.close(fd)
+        try:
+            shutil.copy2(src, part_path)
+            os.replace(part_path, dst)
+        except BaseException:
+            os.unlink(part_path)
+            raise
+        staged += 1
+    return staged
+
+
+def _build_animation_paths() -> dict:
+    """
+    Maps each known animation name to the first existing copy of its clip:
+    staged in RAM, the pipeline's data dir, then the repo's animation-fbx-files.
+    """
+    paths = {}
+    for name in get_args(AnimationName):
+        candidates = (
+            ANIMATION_STAGE_DIR / f"{name}.fbx",
+            ANIMATION_SOURCE_DIR / f"{name}.fbx",
+            Path(PARENT_DIR) / "animation-fbx-files" / f"{name}.fbx",
+        )
+        for candidate in candidates:
+            if candidate.is_file():
+                paths[name] = str(candidate)
+                break
+    return paths
+
+
+def _resolve_animation_file(payload: AnimationOptions):
+    """
+    Resolves the animation FBX for the requested animation name onto the payload.
+    """
+    # Resolved at startup, so there is no filesystem access on the request path
+    animation_file_path = ANIMATION_PATHS.get(payload.animation_name)
+    if animation_file_path is None:
         raise HTTPException(
-            status_code=404, detail=f"Animation file not found: {animation_file_path}"
+            status_code=404,
+            detail=f"Animation file not found: {payload.animation_name}.fbx",
         )
 
     # Assign the resolved path back to the payload field
     # Pydantic will now see a string, not None
     payload.animation_file = animation_file_path
 
+
+def _stage_upload(upload: UploadFile) -> str:
+    """
+    Copies an uploaded mesh into /dev/shm under the extension matching its
+    contents and returns the path, so the pipeline can read it in place.
+    """
+    header = upload.file.read(len(b"Kaydara FBX"))
+    if not header:
+        raise HTTPException(status_code=400, detail="Received empty mesh file.")
+    ext = _detect_mesh_ext(header)
+    upload.file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=ext, dir="/dev/shm", delete=False) as tmp_input:
+        shutil.copyfileobj(upload.file, tmp_input, length=4 * 1024 * 1024)
+    return tmp_input.name
+
+
+@app.post("/animate", response_model=None)
+async def animate(
+    payload: AnimationRequest,
+    _: dict = Depends(_verify_api_key),
+):
+    _resolve_animation_file(payload)
+    # tens of MB of base64 takes long enough to stall other requests
+    mesh_bytes = await run_in_threadpool(b64.b64decode, payload.mesh_b64_str)
+    return await _animate(mesh_bytes, payload)
+
+
+@app.post("/animate_binary", response_model=None)
+async def animate_binary(
+    mesh: UploadFile = File(...),
+    metadata: str = Form(...),
+    _: dict = Depends(_verify_api_key),
+):
+    """
+    Same as /animate, but the mesh is uploaded as a raw multipart file and the
+    remaining options as a JSON `metadata` form field, avoiding base64 entirely.
+    """
+    try:
+        payload = AnimationOptions.model_validate_json(metadata)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    return await _animate_upload(mesh, payload)
+
+
+@app.post("/animate_raw", response_model=None)
+async def animate_raw(
+    mesh: UploadFile = File(...),
+    animation_name: str = Form(...),
+    _: dict = Depends(_verify_api_key),
+):
+    """
+    Same as /animate_binary for clients that only pick the animation: the name is
+    a plain form field and every other option keeps its default.
+    """
+    try:
+        payload = AnimationOptions(animation_name=animation_name)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    return await _animate_upload(mesh, payload)
+
+
+@app.post("/animate_stream", response_model=None)
+async def animate_stream(
+    request: Request,
+    metadata: str = Query(...),
+    _: dict = Depends(_verify_api_key),
+):
+    """
+    Same as /animate, but the request body is the base64 mesh on its own and the
+    remaining options arrive as a JSON `metadata` query parameter. The mesh is
+    decoded into /dev/shm as it streams in, so neither the whole base64 string
+    nor a validated model of it is ever held in memory.
+    """
+    try:
+        payload = AnimationOptions.model_validate_json(metadata)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    _resolve_animation_file(payload)
+
+    input_filepath = await _stage_base64_stream(request)
+    return await _animate_staged(input_filepath, payload)
+
+
+class _Base64StreamDecoder:
+    """
+    Decodes base64 arriving in arbitrarily split chunks, writing each complete
+    4-character group to `out` and carrying the remainder to the next chunk.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.pending = b""
+
+    def feed(self, chunk: bytes):
+        # whitespace would throw off the 4-character alignment
+        data = self.pending + chunk.translate(None, b" \t\r\n")
+        aligned = len(data) - len(data) % 4
+        if aligned:
+            self.out.write(b64.b64decode(data[:aligned]))
+        self.pending = data[aligned:]
+
+    def close(self):
+        if self.pending:
+            # tolerate stripped padding on the final group
+            self.out.write(b64.b64decode(self.pending + b"=" * (-len(self.pending) % 4)))
+            self.pending = b""
+
+
+async def _stage_base64_stream(request: Request) -> str:
+    """
+    Decodes a streamed base64 request body into /dev/shm and returns the path,
+    named with the extension matching the decoded contents.
+    """
+    with tempfile.NamedTemporaryFile(dir="/dev/shm", delete=False) as tmp_input:
+        try:
+            decoder = _Base64StreamDecoder(tmp_input)
+            async for chunk in request.stream():
+                decoder.feed(chunk)
+            decoder.close()
+        except binascii.Error:
+            os.unlink(tmp_input.name)
+            raise HTTPException(status_code=400, detail="Mesh body is not valid base64.")
+        except BaseException:
+            os.unlink(tmp_input.name)
+            raise
+
+    with open(tmp_input.name, "rb") as f:
+        header = f.read(len(b"Kaydara FBX"))
+    if not header:
+        os.unlink(tmp_input.name)
+        raise HTTPException(status_code=400, detail="Received empty mesh data.")
+    input_filepath = tmp_input.name + _detect_mesh_ext(header)
+    os.rename(tmp_input.name, input_filepath)
+    return input_filepath
+
+
+async def _animate_upload(mesh: UploadFile, payload: AnimationOptions):
+    """Stages an uploaded mesh in /dev/shm and animates it in place."""
+    _resolve_animation_file(payload)
+
+    input_filepath = await run_in_threadpool(_stage_upload, mesh)
+    return await _animate_staged(input_filepath, payload)
+
+
+async def _animate_staged(input_filepath: str, payload: AnimationOptions):
+    """Animates a mesh staged on disk, deleting it afterwards."""
+    try:
+        return await _animate(input_filepath, payload)
+    finally:
+        if os.path.exists(input_filepath):
+            os.unlink(input_filepath)
+
+
+async def _animate(mesh: Union[bytes, str], payload: AnimationOptions):
+    """
+    Runs the pipeline and renders on the given mesh bytes or path, and returns
+    the base64-encoded GLB, GIF and thumbnail.
+    """
+    # The pipeline only depends on the mesh and the animation clip
+    cache_key = f"{await run_in_threadpool(_mesh_digest, mesh)}:{payload.animation_name}"
+    cached_body = RESPONSE_CACHE.get(cache_key)
+    if cached_body is not None:
+        print("Serving request from the response cache")
+        return Response(content=cached_body, media_type="application/json")
+
     # Define paths that will be created, initialize to None
     glb_path = None
     output_dir = None
@@ -365,8 +982,9 @@ async def animate(
 
     try:
         try:
-            db = run_pipeline(
-                base64.b64decode(payload.mesh_b64_str), payload.animation_name
+            # vis_blender notices it is off the main thread and runs Blender in a subprocess
+            db = await asyncio.get_running_loop().run_in_executor(
+                PIPELINE_POOL, run_pipeline, mesh, payload.animation_name
             )
         except HTTPException:
             raise
@@ -380,7 +998,7 @@ async def animate(
         if not glb_path or not os.path.isfile(glb_path):
             raise HTTPException(status_code=500, detail="No GLB file was produced.")
 
-        # --- Direct calls to rendering scripts for GIF and Thumbnail ---
+        # --- Render the GIF and thumbnail in one Blender session ---
         try:
             # 1. Define output paths for the render artifacts
             base_path = Path(glb_path)
@@ -389,20 +1007,45 @@ async def animate(
             thumbnail_output_path = output_dir / f"{base_path.stem}_thumbnail.png"
             os.makedirs(frames_output_dir, exist_ok=True)
 
-            # 2. Directly call the thumbnail rendering function
-            logging.info(f"Starting thumbnail rendering for {glb_path}")
-            render_thumbnail.render_thumbnail(glb_path, str(thumbnail_output_path))
-            logging.info(f"Thumbnail successfully rendered to {thumbnail_output_path}")
+            # 2. One warm Blender process imports the GLB once and renders the
+            # thumbnail from that scene alongside the animation frames
+            logging.info(f"Starting thumbnail and frame rendering for {glb_path}")
+            loop = asyncio.get_running_loop()
+            pool = mia.get_blender_pool()
+            try:
+                gif_result = await loop.run_in_executor(
+                    pool,
+                    functools.partial(
+                        render_glb_frames.render_frames,
+                        glb_path,
+                        str(frames_output_dir),
+                        shards=SERVER_RENDER_SHARDS,
+                        thumbnail_path=str(thumbnail_output_path),
+                    ),
+                )
+            except BrokenProcessPool as e:
+                # Rebuild so the next request renders again instead of hitting the dead pool
+                logging.error("Blender pool crashed during rendering; rebuilding it", exc_info=True)
+                print(f"Non-critical rendering error: {e}")
+                mia.replace_broken_blender_pool(pool)
+                gif_result = None
+            except Exception as e:
+                logging.error("Frame rendering failed", exc_info=True)
+                print(f"Non-critical rendering error: {e}")
+                gif_result = None
+
+            # 3. A failed thumbnail only drops its own artifact from the response
+            if os.path.isfile(thumbnail_output_path):
+                logging.info(f"Thumbnail successfully rendered to {thumbnail_output_path}")
+            else:
+                logging.error("Thumbnail rendering failed")
+                print("Non-critical rendering error: no thumbnail was rendered")
 
-            # 3. Directly call the frame rendering function to get the GIF
-            logging.info(f"Starting frame rendering and GIF creation for {glb_path}")
-            gif_path = render_glb_frames.render_frames(glb_path, str(frames_output_dir))
-            if gif_path:
+            if gif_result:
+                gif_path = gif_result
                 logging.info(f"Frames and GIF successfully created. GIF at: {gif_path}")
             else:
-                logging.warning(
-                    "render_frames completed but did not return a GIF path."
-                )
+                logging.error("No GIF was rendered; the response will not include a preview.")
 
         except Exception as e:
             # Log rendering errors but don't block the response
@@ -413,18 +1056,15 @@ async def animate(
         # --- Base64 encode all three files for the JSON response ---
         glb_base64 = None
         if glb_path and os.path.isfile(glb_path):
-            with open(glb_path, "rb") as f:
-                glb_base64 = base64.b64encode(f.read()).decode("utf-8")
+            glb_base64 = await run_in_threadpool(_b64_file, glb_path)
 
         gif_base64 = None
         if gif_path and os.path.isfile(gif_path):
-            with open(gif_path, "rb") as f:
-                gif_base64 = base64.b64encode(f.read()).decode("utf-8")
+            gif_base64 = await run_in_threadpool(_b64_file, gif_path)
 
         thumb_base64 = None
         if thumbnail_output_path and os.path.isfile(thumbnail_output_path):
-            with open(thumbnail_output_path, "rb") as f:
-                thumb_base64 = base64.b64encode(f.read()).decode("utf-8")
+            thumb_base64 = await run_in_threadpool(_b64_file, thumbnail_output_path)
 
         response_data = {
             "mesh_base64": glb_base64,
@@ -432,17 +1072,39 @@ async def animate(
             "thumbnail_base64": thumb_base64,
         }
 
-        return JSONResponse(content=response_data)
+        # Deleting the frame dump can take hundreds of ms; do it after the
+        # response has been sent rather than making the client wait for it
+        cleanup = BackgroundTasks()
+        if output_dir:
+            cleanup.add_task(_cleanup_render_dir, output_dir)
+            output_dir = None
+        response = AnimationResponse(content=response_data, background=cleanup)
+        # A missing GIF or thumbnail is a transient render failure; don't make it stick
+        if all(response_data.values()):
+            RESPONSE_CACHE.put(cache_key, response.body)
+        return response
 
     finally:
         # --- Cleanup ---
-        # Clean up the temporary directory created for rendering artifacts
-        if output_dir and os.path.isdir(output_dir):
-            try:
-                shutil.rmtree(output_dir)
-                logging.info(f"Successfully cleaned up render directory: {output_dir}")
-            except Exception as e:
-                logging.error(f"Failed to clean up render directory {output_dir}: {e}")
+        # Only reached with output_dir still set when no response was built
+        if output_dir:
+            _cleanup_render_dir(output_dir)
+
+
+def _cleanup_render_dir(output_dir: Union[str, os.PathLike]):
+    """Removes the temporary directory created for rendering artifacts."""
+    if os.path.isdir(output_dir):
+        try:
+            shutil.rmtree(output_dir)
+            logging.info(f"Successfully cleaned up render directory: {output_dir}")
+        except Exception as e:
+            logging.error(f"Failed to clean up render directory {output_dir}: {e}")
+
+
+@app.get("/health")
+def health_check():
+    """Readiness probe; only answers once the lifespan has loaded the models."""
+    return {"status": "ok"}
 
 
 if __name__ == "__main__":
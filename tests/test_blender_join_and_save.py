@@ -0,0 +1,59 @@
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+trimesh = pytest.importorskip("trimesh")
+pytest.importorskip("bpy")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util import blender_join_and_save  # noqa: E402
+
+
+def _box(material, offset):
+    box = trimesh.creation.box()
+    box.apply_translation(offset)
+    box.visual = trimesh.visual.TextureVisuals(uv=np.zeros((len(box.vertices), 2)), material=material)
+    return box
+
+
+def _glb_materials(path):
+    with open(path, 'rb') as f:
+        f.read(12)
+        chunk_length, _chunk_type = struct.unpack('<I4s', f.read(8))
+        doc = json.loads(f.read(chunk_length))
+    return doc.get('materials', [])
+
+
+def test_two_material_gltf_keeps_both_materials(tmp_path):
+    red = trimesh.visual.material.PBRMaterial(name="red", baseColorFactor=[255, 0, 0, 255])
+    blue = trimesh.visual.material.PBRMaterial(name="blue", baseColorFactor=[0, 0, 255, 255])
+    input_path = str(tmp_path / "two_materials.glb")
+    output_path = str(tmp_path / "joined.glb")
+    trimesh.Scene([_box(red, [0, 0, 0]), _box(blue, [3, 0, 0])]).export(input_path)
+
+    # The trimesh fast path must decline rather than merge the visuals
+    assert blender_join_and_save._join_and_save_trimesh(input_path, output_path) is False
+    assert not os.path.exists(output_path)
+
+    blender_join_and_save.join_and_save_mesh(input_path, output_path)
+
+    materials = _glb_materials(output_path)
+    assert len(materials) == 2
+    assert sorted(m.get('name') for m in materials) == ["blue", "red"]
+
+
+def test_single_material_gltf_uses_fast_path(tmp_path):
+    red = trimesh.visual.material.PBRMaterial(name="red", baseColorFactor=[255, 0, 0, 255])
+    input_path = str(tmp_path / "one_material.glb")
+    output_path = str(tmp_path / "joined.glb")
+    trimesh.Scene([_box(red, [0, 0, 0]), _box(red, [3, 0, 0])]).export(input_path)
+
+    assert blender_join_and_save._join_and_save_trimesh(input_path, output_path) is True
+
+    joined = trimesh.load(output_path, force='scene', process=False)
+    assert len(joined.geometry) == 1
+    assert len(_glb_materials(output_path)) == 1
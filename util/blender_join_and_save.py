@@ -2,13 +2,75 @@
 import bpy
 import sys
 import os
+import json
+import struct
+
+GLTF_EXTS = ('.glb', '.gltf')
+
+
+def _gltf_has_rig(path):
+    """
+    Returns True if a glTF/GLB file carries skins or animations. Only the JSON
+    chunk is read; the binary buffers are never touched.
+    """
+    if path.lower().endswith('.gltf'):
+        with open(path, 'r', encoding='utf-8') as f:
+            doc = json.load(f)
+    else:
+        with open(path, 'rb') as f:
+            magic, _version, _length = struct.unpack('<4sII', f.read(12))
+            chunk_length, chunk_type = struct.unpack('<I4s', f.read(8))
+            if magic != b'glTF' or chunk_type != b'JSON':
+                raise ValueError(f"Not a valid GLB file: {path}")
+            doc = json.loads(f.read(chunk_length))
+    return bool(doc.get('skins') or doc.get('animations'))
+
+
+def _join_and_save_trimesh(input_path, output_path):
+    """
+    Joins every mesh of a static glTF scene into one and writes it as GLB,
+    without going through Blender. Node transforms are baked in, so parts keep
+    their original positions.
+
+    Returns False without writing anything if the parts use more than one
+    material, since concatenating them would merge or drop their visuals;
+    the caller then falls back to Blender, which keeps per-part materials.
+    """
+    import trimesh
+
+    scene = trimesh.load(input_path, force='scene', process=False)
+    geometries = [g for g in scene.geometry.values() if isinstance(g, trimesh.Trimesh)]
+    if not geometries:
+        raise RuntimeError("No mesh objects found to join.")
+    # The glTF loader hands primitives that share a material the same object
+    if len({id(getattr(g.visual, 'material', None)) for g in geometries}) > 1:
+        return False
+    meshes = [g for g in scene.dump() if isinstance(g, trimesh.Trimesh)]
+    joined = trimesh.util.concatenate(meshes)
+    joined.export(output_path, file_type='glb')
+    return True
+
 
 def join_and_save_mesh(input_path, output_path):
     """
     Clears the Blender scene by deleting all objects, imports a mesh,
     removes non-essential objects, joins all mesh parts into a single object,
     cleans unused data, and exports it, preserving original positions.
+
+    Static single-material glTF in and GLB out is handled by trimesh instead,
+    which is much faster; anything with an armature, animation or several
+    materials, and all FBX, goes through Blender so the rig and the per-part
+    materials survive the round trip.
     """
+    if (
+        input_path.lower().endswith(GLTF_EXTS)
+        and output_path.lower().endswith('.glb')
+        and not _gltf_has_rig(input_path)
+        and _join_and_save_trimesh(input_path, output_path)
+    ):
+        print(f"Successfully joined meshes and saved to {output_path}")
+        return
+
     # Clear existing objects without resetting scene settings
     if bpy.context.scene.objects:
         bpy.ops.object.select_all(action='SELECT')
@@ -17,7 +79,7 @@ def join_and_save_mesh(input_path, output_path):
     # Import the mesh
     if input_path.lower().endswith('.fbx'):
         bpy.ops.import_scene.fbx(filepath=input_path)
-    elif input_path.lower().endswith(('.glb', '.gltf')):
+    elif input_path.lower().endswith(GLTF_EXTS):
         bpy.ops.import_scene.gltf(filepath=input_path)
     else:
         # Raise an exception for better error handling in the server
@@ -63,7 +125,7 @@ def join_and_save_mesh(input_path, output_path):
     # Export the joined mesh to the specified output path
     if output_path.lower().endswith('.fbx'):
         bpy.ops.export_scene.fbx(filepath=output_path, use_selection=True)
-    elif output_path.lower().endswith(('.glb', '.gltf')):
+    elif output_path.lower().endswith(GLTF_EXTS):
         bpy.ops.export_scene.gltf(filepath=output_path, export_format='GLB', use_selection=True)
     else:
         # Raise an exception for better error handling
@@ -1,11 +1,16 @@
 import bpy
 import sys
 import os
+import shutil
+import subprocess
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Pillow is now required for GIF creation
 try:
-    from PIL import Image
+    from PIL import GifImagePlugin, Image, ImageChops
 except ImportError:
     print("Error: The 'Pillow' library is required to create a GIF. Please install it.", file=sys.stderr)
     print("Example: /path/to/blender/python/bin/python -m pip install Pillow", file=sys.stderr)
@@ -13,50 +18,76 @@ except ImportError:
 
 # Assumes render_utils is in the same directory, e.g., 'util/render_utils.py'
 try:
-    from . import render_utils
+    from . import render_utils, render_thumbnail
 except ImportError:
     import render_utils
+    import render_thumbnail
 
 
-def render_frames(glb_path, output_dir):
+# Default number of Blender processes a render is split across; override with
+# MIA_RENDER_SHARDS (1 renders everything in the calling process).
+DEFAULT_RENDER_SHARDS = int(os.environ.get("MIA_RENDER_SHARDS", "4"))
+# Render threads when a single process renders the whole range.
+SINGLE_PROCESS_THREADS = 20
+# Frames are intermediates for the preview, so they're rendered onto tmpfs
+# (falling back to the system temp dir) and only the preview lands on disk.
+FRAME_STAGE_ROOT = os.environ.get("MIA_FRAME_STAGE_DIR", "/dev/shm")
+# Preview formats: 'gif' is what the server returns; the others are encoded by
+# piping raw RGB frames into ffmpeg and fall back to GIF when it isn't installed.
+PREVIEW_FORMATS = ("gif", "mp4", "webm")
+# Per-frame duration of the GIF preview in milliseconds.
+GIF_FRAME_DURATION = 40
+# Matches the 40 ms per-frame duration of the GIF preview.
+PREVIEW_FPS = 25
+VIDEO_CODEC_ARGS = {
+    "mp4": ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-crf", "20", "-movflags", "+faststart"],
+    "webm": ["-c:v", "libvpx-vp9", "-pix_fmt", "yuv420p", "-crf", "32", "-b:v", "0"],
+}
+
+
+def _setup_scene(glb_path, options):
     """
-    Renders an animated GLB file to a sequence of PNG frames and assembles them
-    into a single animated GIF.
+    Loads the GLB into an empty scene, frames the camera on it and configures
+    rendering. Returns the scene with its frame range set from the animation.
+    `options` comes from _render_options and has to match across shards.
     """
     # --- Scene Setup ---
-    bpy.ops.object.select_all(action='SELECT')
-    bpy.ops.object.delete()
+    render_utils.clear_scene()
 
     # --- Import GLB ---
     if not os.path.exists(glb_path):
         raise FileNotFoundError(f"Error: GLB file not found at {glb_path}")
 
-    bpy.ops.import_scene.gltf(filepath=glb_path)
+    # The importer sets the scene range to the animation's; collapse it first so
+    # a range left by the factory scene or a previous job can't pass for it
     scene = bpy.context.scene
+    scene.frame_start = scene.frame_end = 1
+    bpy.ops.import_scene.gltf(filepath=glb_path)
 
     # --- Camera Setup using Utilities ---
     render_utils.create_and_setup_camera(scene)
-    render_utils.frame_all_objects(scene)
 
     # --- Set Frame Range from Animation ---
-    anim_data_objects = [obj for obj in scene.objects if obj.animation_data and obj.animation_data.action]
-    if not anim_data_objects:
-        raise RuntimeError("No animation data found in the imported GLB.")
-    min_frame, max_frame = float('inf'), float('-inf')
-    for obj in anim_data_objects:
-        action = obj.animation_data.action
-        if action and action.frame_range:
-            min_frame = min(min_frame, action.frame_range[0])
-            max_frame = max(max_frame, action.frame_range[1])
-    if min_frame == float('inf') or max_frame == float('-inf'):
-         raise RuntimeError("Could not determine frame range from animation.")
-    scene.frame_start = int(min_frame)
-    scene.frame_end = int(max_frame)
+    if scene.frame_end <= scene.frame_start:
+        # Importer didn't set a range: reduce over the actions themselves, which
+        # is one list instead of every object's animation data
+        frame_ranges = [action.frame_range for action in bpy.data.actions if action.users]
+        if not frame_ranges:
+            raise RuntimeError("No animation data found in the imported GLB.")
+        scene.frame_start = int(min(r[0] for r in frame_ranges))
+        scene.frame_end = int(max(r[1] for r in frame_ranges))
+
+    render_utils.frame_all_objects(scene, exact=options["exact_bounds"])
 
     # --- Configure Rendering ---
-    scene.render.image_settings.file_format = 'PNG'
+    # Frames are only an intermediate for the GIF; uncompressed BMP skips a zlib
+    # encode per frame in Blender and a PNG decode per frame in Pillow, while
+    # keeping exactly the pixels (view transform included) a PNG would hold.
+    # Render Result pixels aren't readable from Python, so a file is still needed.
+    scene.render.image_settings.file_format = 'BMP'
     scene.render.image_settings.color_mode = 'RGB'
     scene.render.film_transparent = False
+    render_utils.configure_preview_output(scene)
     
     # Set the World background to pure white
     world = scene.world
@@ -71,42 +102,354 @@ def render_frames(glb_path, output_dir):
         bg_node.inputs['Strength'].default_value = 0.3
 
     # --- Performance Settings ---
+    render_utils.configure_render_quality(scene, options["quality"])
+    return scene
+
+
+def _render_options(exact_bounds=False, quality="preview"):
+    """Scene setup options; shards rebuild the parent's scene from them."""
+    if quality not in render_utils.RENDER_QUALITIES:
+        raise ValueError(f"Unknown render quality '{quality}', expected one of {render_utils.RENDER_QUALITIES}.")
+    return {"exact_bounds": exact_bounds, "quality": quality}
+
+
+def _shard_range(frame_start, frame_end, shard, shards):
+    """Splits [frame_start, frame_end] evenly and returns the inclusive bounds of one shard."""
+    total = frame_end - frame_start + 1
+    lo = frame_start + (total * shard) // shards
+    hi = frame_start + (total * (shard + 1)) // shards - 1
+    return lo, hi
+
+
+def _adaptive_palette(path):
+    """
+    Decodes a frame and builds a 256-colour adaptive palette from it; the
+    returned image only carries that palette, shared by every frame.
+    """
+    with Image.open(path) as im:
+        adaptive = im.convert('P', palette=Image.Palette.ADAPTIVE, colors=256)
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(adaptive.getpalette())
+    return palette_image
+
+
+def _load_and_quantize(path, palette_future):
+    """
+    Decodes one frame and maps it onto the shared palette, which skips the
+    per-frame median cut and lets the GIF carry a single global palette.
+    """
+    palette = palette_future.result()
+    with Image.open(path) as im:
+        return im.quantize(palette=palette, dither=Image.Dither.NONE)
+
+
+def _set_frame_output(scene, output_dir):
+    """Points the render output at output_dir; Blender appends the frame number to the prefix."""
+    scene.render.filepath = os.path.join(output_dir, "frame_")
+    scene.render.use_file_extension = True
+
+
+def _render_range(scene, output_dir, frame_start, frame_end, threads, on_frame=None):
+    """
+    Renders frames frame_start..frame_end (inclusive) to images in output_dir,
+    calling on_frame(path) as each one is written.
+    """
     scene.render.threads_mode = 'FIXED'
-    desired_threads = 20
-    scene.render.threads = desired_threads
-    print(f"Set render threads mode to FIXED with {desired_threads} threads.")
-    scene.eevee.taa_render_samples = 16
-    print(f"Render samples set to {scene.eevee.taa_render_samples} for faster rendering.")
-    
-    # --- Render Animation Manually ---
-    print(f"Rendering frames {scene.frame_start} to {scene.frame_end} manually...")
-    for frame in range(scene.frame_start, scene.frame_end + 1):
-        scene.frame_set(frame)
-        scene.render.filepath = os.path.join(output_dir, f"frame_{frame:04d}")
-        print(f"Rendering frame {frame} of {scene.frame_end}...")
-        bpy.ops.render.render(write_still=True)
+    scene.render.threads = threads
+    print(f"Set render threads mode to FIXED with {threads} threads.")
+
+    # --- Render Animation ---
+    # One animation render keeps Eevee's render state across frames instead of
+    # re-entering the operator per frame
+    _set_frame_output(scene, output_dir)
+
+    def frame_written(scene, *args):
+        print(f"Rendered frame {scene.frame_current} of {frame_end}.")
+        if on_frame is not None:
+            on_frame(scene.render.frame_path(frame=scene.frame_current))
+
+    full_range = scene.frame_start, scene.frame_end
+    scene.frame_start, scene.frame_end = frame_start, frame_end
+    bpy.app.handlers.render_write.append(frame_written)
+    print(f"Rendering frames {frame_start} to {frame_end}...")
+    try:
+        bpy.ops.render.render(animation=True)
+    finally:
+        bpy.app.handlers.render_write.remove(frame_written)
+        scene.frame_start, scene.frame_end = full_range
     print("Frame rendering complete.")
 
-    # --- GIF Construction Logic ---
-    print("Assembling animated GIF...")
-    frame_files = sorted(
-        [os.path.join(output_dir, f) for f in os.listdir(output_dir) if f.endswith(".png")]
-    )
-    if not frame_files:
-        raise RuntimeError("Blender did not produce any output frames. Cannot create GIF.")
-    
-    images = [Image.open(f) for f in frame_files]
-    output_parent_dir = Path(output_dir).parent
-    gif_path = output_parent_dir / f"{Path(glb_path).stem}_animated.gif"
-    
-    images[0].save(
-        str(gif_path),
-        save_all=True,
-        append_images=images[1:],
-        duration=40,
-        loop=0,
-        disposal=2
-    )
+
+def _shard_command(glb_path, output_dir, shard, shards, options):
+    """Command line that renders one shard in a fresh headless Blender."""
+    script_args = ["--", glb_path, output_dir, "--shard", f"{shard}/{shards}", f"--quality={options['quality']}"]
+    # Every shard has to frame the camera exactly like the parent did
+    if options["exact_bounds"]:
+        script_args.append("--exact-bounds")
+    binary = bpy.app.binary_path
+    if binary and os.path.basename(binary).lower().startswith("blender"):
+        return [binary, "--background", "--factory-startup", "--python", __file__, *script_args]
+    # bpy installed as a Python module: the interpreter hosting it runs this script
+    return [sys.executable, __file__, *script_args]
+
+
+def render_shard(glb_path, output_dir, shard, shards, exact_bounds=False, quality="preview"):
+    """Renders only the frames of one shard; used by the --shard CLI entry point."""
+    scene = _setup_scene(glb_path, _render_options(exact_bounds, quality))
+    lo, hi = _shard_range(scene.frame_start, scene.frame_end, shard, shards)
+    if lo <= hi:
+        _render_range(scene, output_dir, lo, hi, max(1, (os.cpu_count() or 1) // shards))
+
+
+def _render_all(scene, glb_path, output_dir, shards, options, on_frame, side_render=None):
+    """
+    Renders the scene's whole frame range, in this process or across `shards`
+    Blender processes, calling on_frame(path) for every frame in order.
+    side_render() runs in this process first, or while the shards render.
+    """
+    frame_count = scene.frame_end - scene.frame_start + 1
+    shards = max(1, min(shards or DEFAULT_RENDER_SHARDS, frame_count))
+    if shards == 1:
+        if side_render is not None:
+            side_render()
+        _render_range(
+            scene, output_dir, scene.frame_start, scene.frame_end, SINGLE_PROCESS_THREADS,
+            on_frame=on_frame,
+        )
+        return
+
+    print(f"Rendering {frame_count} frames across {shards} Blender processes...")
+    procs = [
+        subprocess.Popen(_shard_command(glb_path, output_dir, i, shards, options), stdout=subprocess.DEVNULL)
+        for i in range(shards)
+    ]
+    if side_render is not None:
+        side_render()
+    failed = [i for i, proc in enumerate(procs) if proc.wait() != 0]
+    if failed:
+        raise RuntimeError(f"Render shards {failed} of {shards} failed.")
+    print("Frame rendering complete.")
+    # Shards render with this scene's settings, so their file names are known
+    # up front; no directory scan or sort
+    _set_frame_output(scene, output_dir)
+    for frame in range(scene.frame_start, scene.frame_end + 1):
+        path = scene.render.frame_path(frame=frame)
+        if not os.path.isfile(path):
+            raise RuntimeError(f"Render shards did not produce frame {frame} ({path}).")
+        on_frame(path)
+
+
+def _ffmpeg_command(size, video_path, preview_format):
+    """ffmpeg invocation encoding raw RGB frames of `size` read from stdin."""
+    width, height = size
+    return [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(PREVIEW_FPS), "-i", "-",
+        # yuv420p needs even dimensions
+        "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        *VIDEO_CODEC_ARGS[preview_format],
+        str(video_path),
+    ]
+
+
+def _encode_video(scene, glb_path, frames_dir, video_path, shards, options, preview_format, side_render):
+    """
+    Renders the animation and streams every frame into ffmpeg as it lands,
+    skipping palette quantization and LZW entirely.
+    """
+    ffmpeg = None
+
+    def write_frame(path):
+        nonlocal ffmpeg
+        with Image.open(path) as im:
+            # Frames are written as RGB BMPs, so this is a straight decode without a conversion pass
+            rgb = im if im.mode == 'RGB' else im.convert('RGB')
+            raw, size = rgb.tobytes(), rgb.size
+        if ffmpeg is None:
+            ffmpeg = subprocess.Popen(_ffmpeg_command(size, video_path, preview_format), stdin=subprocess.PIPE)
+        try:
+            ffmpeg.stdin.write(raw)
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg exited early with code {ffmpeg.wait()}.")
+
+    try:
+        _render_all(scene, glb_path, frames_dir, shards, options, write_frame, side_render)
+    except BaseException:
+        if ffmpeg is not None:
+            ffmpeg.kill()
+            ffmpeg.wait()
+        raise
+    if ffmpeg is None:
+        raise RuntimeError("Blender did not produce any output frames. Cannot create video.")
+    ffmpeg.stdin.close()
+    if ffmpeg.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed with code {ffmpeg.returncode}.")
+
+    print(f"Animated {preview_format.upper()} successfully saved to: {video_path}")
+    return str(video_path)
+
+
+def _resolve_preview_format(preview_format):
+    """Validates the preview format, falling back to GIF when ffmpeg isn't installed."""
+    if preview_format not in PREVIEW_FORMATS:
+        raise ValueError(f"Unknown preview format '{preview_format}', expected one of {PREVIEW_FORMATS}.")
+    if preview_format != "gif" and shutil.which("ffmpeg") is None:
+        print(f"ffmpeg not found; falling back to a GIF preview instead of {preview_format}.")
+        return "gif"
+    return preview_format
+
+
+def render_frames(
+    glb_path, output_dir, shards=None, preview_format="gif", exact_bounds=False, quality="preview",
+    thumbnail_path=None,
+):
+    """
+    Renders an animated GLB file to a sequence of frames and assembles them
+    into a single animated preview (GIF by default, or MP4/WebM via ffmpeg).
+    The frame range is split across `shards` headless Blender processes
+    rendering in parallel. With `thumbnail_path`, the thumbnail is rendered
+    from the same imported scene; a failed thumbnail doesn't stop the preview.
+    """
+    preview_format = _resolve_preview_format(preview_format)
+    options = _render_options(exact_bounds, quality)
+    scene = _setup_scene(glb_path, options)
+    return _render_preview(scene, glb_path, output_dir, shards, options, preview_format, thumbnail_path)
+
+
+def render_many(jobs, shards=None, preview_format="gif", exact_bounds=False, quality="preview"):
+    """
+    Renders previews for a list of (glb_path, output_dir) pairs in this one
+    Blender process, paying interpreter and add-on startup once; the camera
+    and lights built for the first job are reused by the rest. Returns the
+    preview paths, with None for jobs that failed.
+    """
+    preview_format = _resolve_preview_format(preview_format)
+    options = _render_options(exact_bounds, quality)
+    results = []
+    for glb_path, output_dir in jobs:
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            scene = _setup_scene(glb_path, options)
+            results.append(_render_preview(scene, glb_path, output_dir, shards, options, preview_format))
+        except (FileNotFoundError, RuntimeError) as e:
+            print(f"Error rendering {glb_path}: {e}", file=sys.stderr)
+            results.append(None)
+    return results
+
+
+def _render_thumbnail_safely(scene, thumbnail_path):
+    try:
+        # The still keeps final quality even though the animation renders at preview
+        render_thumbnail.render_scene_thumbnail(scene, thumbnail_path, quality="final")
+    except Exception as e:
+        print(f"Error rendering thumbnail {thumbnail_path}: {e}", file=sys.stderr)
+
+
+def _render_preview(scene, glb_path, output_dir, shards, options, preview_format, thumbnail_path=None):
+    """
+    Renders the set-up scene and writes its animated preview in
+    `preview_format` next to output_dir, plus the thumbnail if asked for.
+    """
+    side_render = None
+    if thumbnail_path:
+        side_render = lambda: _render_thumbnail_safely(scene, thumbnail_path)
+    preview_path = Path(output_dir).parent / f"{Path(glb_path).stem}_animated.{preview_format}"
+    stage_root = FRAME_STAGE_ROOT if os.path.isdir(FRAME_STAGE_ROOT) else None
+    frames_dir = tempfile.mkdtemp(prefix="mia-frames-", dir=stage_root)
+    try:
+        if preview_format != "gif":
+            return _encode_video(scene, glb_path, frames_dir, preview_path, shards, options, preview_format, side_render)
+        return _write_gif(scene, glb_path, frames_dir, preview_path, shards, options, side_render)
+    finally:
+        shutil.rmtree(frames_dir, ignore_errors=True)
+
+
+class _GifStream:
+    """
+    Writes an animated GIF one frame at a time through Pillow's GIF block
+    writers, so frames are LZW-encoded as they arrive instead of being
+    collected for Image.save(save_all=True).
+
+    Every frame has to share the first frame's palette, which is written once
+    as the global color table. Frames are opaque, so each later one is cropped
+    to what changed since the previous one (disposal 1), and a run of
+    identical frames becomes one longer frame.
+    """
+
+    def __init__(self, path, duration, loop=0):
+        self._fp = open(path, "wb")
+        self._duration = duration
+        self._loop = loop
+        self._previous = None
+        # Held back one frame so identical successors can extend its duration
+        self._pending = None
+
+    def append(self, frame):
+        if self._previous is None:
+            for block in GifImagePlugin._get_global_header(frame, {"loop": self._loop, "duration": self._duration}):
+                self._fp.write(block)
+            self._pending = [frame, (0, 0), self._duration]
+        else:
+            bbox = ImageChops.subtract_modulo(frame, self._previous).getbbox()
+            if bbox is None:
+                self._pending[2] += self._duration
+                return
+            self._write_pending()
+            self._pending = [frame.crop(bbox), bbox[:2], self._duration]
+        self._previous = frame
+
+    def _write_pending(self):
+        image, offset, duration = self._pending
+        GifImagePlugin._write_frame_data(self._fp, image, offset, {"duration": duration, "disposal": 1})
+
+    def close(self):
+        if self._pending is not None:
+            self._write_pending()
+        self._fp.write(b";")  # trailer
+        self._fp.close()
+
+    def abort(self):
+        self._fp.close()
+        os.remove(self._fp.name)
+
+
+def _write_gif(scene, glb_path, frames_dir, gif_path, shards, options, side_render):
+    """Renders the animation and encodes the frames into an animated GIF as they're quantized."""
+    gif = _GifStream(str(gif_path), GIF_FRAME_DURATION)
+    try:
+        # Frames are decoded and quantized on worker threads; Pillow drops the GIL
+        # for that, so in a single process it overlaps with rendering the next frame
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            frame_futures = deque()
+            palette_future = None
+
+            def write_ready_frames():
+                # Frames go out in order as soon as they're quantized, keeping
+                # only the ones still in flight in memory
+                while frame_futures and frame_futures[0].done():
+                    gif.append(frame_futures.popleft().result())
+
+            def submit_frame(path):
+                nonlocal palette_future
+                # The first frame defines the palette; every frame, the first included,
+                # is then mapped onto it the same way so equal pixels get equal indices
+                if palette_future is None:
+                    palette_future = executor.submit(_adaptive_palette, path)
+                frame_futures.append(executor.submit(_load_and_quantize, path, palette_future))
+                write_ready_frames()
+
+            _render_all(scene, glb_path, frames_dir, shards, options, submit_frame, side_render)
+
+            # --- GIF Construction Logic ---
+            print("Assembling animated GIF...")
+            if palette_future is None:
+                raise RuntimeError("Blender did not produce any output frames. Cannot create GIF.")
+            while frame_futures:
+                gif.append(frame_futures.popleft().result())
+    except BaseException:
+        gif.abort()
+        raise
+    gif.close()
 
     print(f"Animated GIF successfully saved to: {gif_path}")
     return str(gif_path)
@@ -118,14 +461,42 @@ if __name__ == "__main__":
         args = argv[argv.index("--") + 1:]
     except ValueError:
         args = []
+    exact_bounds = "--exact-bounds" in args
+    quality = next((arg.split("=", 1)[1] for arg in args if arg.startswith("--quality=")), "preview")
+    thumbnail_path = next((arg.split("=", 1)[1] for arg in args if arg.startswith("--thumbnail=")), None)
+    args = [
+        arg for arg in args
+        if arg != "--exact-bounds" and not arg.startswith(("--quality=", "--thumbnail="))
+    ]
+    if args[:1] == ["--batch"] and len(args) >= 3 and len(args) % 2 == 1:
+        pairs = list(zip(args[1::2], args[2::2]))
+        outputs = render_many(pairs, exact_bounds=exact_bounds, quality=quality)
+        for (input_glb, _), output in zip(pairs, outputs):
+            print(f"{input_glb} -> {output}")
+        sys.exit(0 if all(outputs) else 1)
+    shard = None
+    preview_format = "gif"
+    if len(args) == 4 and args[2] == "--shard":
+        shard, shards = (int(x) for x in args[3].split("/"))
+        args = args[:2]
+    elif len(args) == 4 and args[2] == "--format" and args[3] in PREVIEW_FORMATS:
+        preview_format = args[3]
+        args = args[:2]
     if len(args) != 2:
-        print("Usage: blender --background --python render_glb_frames.py -- <path_to_glb> <frame_output_directory>", file=sys.stderr)
+        print("Usage: blender --background --python render_glb_frames.py -- <path_to_glb> <frame_output_directory> [--shard i/N | --format gif|mp4|webm] [--exact-bounds] [--quality=preview|final] [--thumbnail=<png_path>]", file=sys.stderr)
+        print("       blender --background --python render_glb_frames.py -- --batch <glb> <frame_output_directory> [<glb> <frame_output_directory> ...] [--exact-bounds] [--quality=preview|final]", file=sys.stderr)
         sys.exit(1)
     input_glb, frame_output_dir = args
     os.makedirs(frame_output_dir, exist_ok=True)
     try:
-        final_gif_path = render_frames(input_glb, frame_output_dir)
-        print(f"\nFinal output path: {final_gif_path}")
-    except (FileNotFoundError, RuntimeError, ImportError) as e:
+        if shard is not None:
+            render_shard(input_glb, frame_output_dir, shard, shards, exact_bounds, quality)
+        else:
+            final_gif_path = render_frames(
+                input_glb, frame_output_dir, preview_format=preview_format, exact_bounds=exact_bounds, quality=quality,
+                thumbnail_path=thumbnail_path,
+            )
+            print(f"\nFinal output path: {final_gif_path}")
+    except (FileNotFoundError, RuntimeError, ImportError, ValueError) as e:
         print(f"Error: {e}", file=sys.stderr)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
@@ -9,13 +9,53 @@ except ImportError:
     # Fallback for running the script directly
     import render_utils
 
-def render_thumbnail(glb_path, output_image_path):
+def render_scene_thumbnail(scene, output_image_path, quality="final"):
+    """
+    Renders the thumbnail of an already set-up scene (GLB imported, camera
+    framed) from its starting pose at `quality`, then restores the render
+    settings and frame it changed so an animation render can continue in the
+    same session.
+    """
+    render, image = scene.render, scene.render.image_settings
+    saved = (image.file_format, image.color_mode, render.film_transparent,
+             render.resolution_x, render.resolution_y, render.filepath)
+    saved_quality = render_utils.capture_render_quality(scene)
+    saved_frame = scene.frame_current
+
+    # --- Configure Rendering ---
+    image.file_format = 'PNG'
+    image.color_mode = 'RGBA'
+    # The thumbnail can have a transparent background, which is often desirable.
+    render.film_transparent = True
+    render.resolution_x = 512
+    render.resolution_y = 512
+    render.filepath = output_image_path
+    render_utils.configure_render_quality(scene, quality)
+    scene.frame_set(scene.frame_start)
+
+    # --- Render a Single Frame ---
+    try:
+        print(f"Rendering thumbnail to {output_image_path}...")
+        bpy.ops.render.render(write_still=True)
+        print("Thumbnail rendering complete.")
+    finally:
+        # File format goes back first so the color mode it allows can follow
+        (image.file_format, image.color_mode, render.film_transparent,
+         render.resolution_x, render.resolution_y, render.filepath) = saved
+        render_utils.restore_render_quality(scene, saved_quality)
+        scene.frame_set(saved_frame)
+
+
+def render_thumbnail(glb_path, output_image_path, quality="final"):
     """
     Renders a single thumbnail image from a GLB file's starting pose.
+    `quality` is one of render_utils.RENDER_QUALITIES; a lone still keeps the
+    full sample count by default. When the animation is rendered as well,
+    render_glb_frames.render_frames(thumbnail_path=...) does both in one
+    session and skips this import and setup.
     """
     # --- Scene Setup ---
-    bpy.ops.object.select_all(action='SELECT')
-    bpy.ops.object.delete()
+    render_utils.clear_scene()
 
     # --- Import GLB ---
     if not os.path.exists(glb_path):
@@ -32,29 +72,17 @@ def render_thumbnail(glb_path, output_image_path):
     render_utils.create_and_setup_camera(scene)
     render_utils.frame_all_objects(scene)
     
-    # --- Configure Rendering ---
-    scene.render.image_settings.file_format = 'PNG'
-    scene.render.filepath = output_image_path
-    # The thumbnail can have a transparent background, which is often desirable.
-    scene.render.film_transparent = True
-    scene.render.image_settings.color_mode = 'RGBA'
-    scene.render.resolution_x = 512
-    scene.render.resolution_y = 512
+    render_utils.configure_preview_output(scene)
     
     # --- NEW: Performance Settings ---
     scene.render.threads_mode = 'FIXED'
     desired_threads = 20
     scene.render.threads = desired_threads
     print(f"Set render threads mode to FIXED with {desired_threads} threads.")
-    # Reduce render samples for faster previews (default is 64 for Eevee)
-    scene.eevee.taa_render_samples = 16
-    print(f"Render samples set to {scene.eevee.taa_render_samples} for faster rendering.")
     # --- END of Performance Settings ---
     
-    # --- Render a Single Frame ---
-    print(f"Rendering thumbnail to {output_image_path}...")
-    bpy.ops.render.render(write_still=True)
-    print("Thumbnail rendering complete.")
+    # Eevee samples and effects are set from `quality` for the still
+    render_scene_thumbnail(scene, output_image_path, quality)
 
 
 if __name__ == "__main__":
@@ -63,15 +91,17 @@ if __name__ == "__main__":
         args = argv[argv.index("--") + 1:]
     except ValueError:
         args = []
+    quality = next((arg.split("=", 1)[1] for arg in args if arg.startswith("--quality=")), "final")
+    args = [arg for arg in args if not arg.startswith("--quality=")]
 
-    if len(args) != 2:
-        print("Usage: blender --background --python render_thumbnail.py -- <path_to_glb> <output_image_path>", file=sys.stderr)
+    if len(args) != 2 or quality not in render_utils.RENDER_QUALITIES:
+        print("Usage: blender --background --python render_thumbnail.py -- <path_to_glb> <output_image_path> [--quality=preview|final]", file=sys.stderr)
         sys.exit(1)
 
     input_glb, output_image = args
     
     try:
-        render_thumbnail(input_glb, output_image)
+        render_thumbnail(input_glb, output_image, quality)
     except FileNotFoundError as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
\ No newline at end of file
@@ -1,81 +1,281 @@
 import bpy
+import numpy as np
 from mathutils import Vector
 
+# Collection holding the camera and lights; it survives clear_scene so a
+# long-lived Blender process builds the rig only once.
+RIG_COLLECTION_NAME = "MIA_Rig"
+
+
+def rig_objects():
+    """The camera and lights of the persistent rig, or an empty list if it hasn't been built."""
+    collection = bpy.data.collections.get(RIG_COLLECTION_NAME)
+    return list(collection.objects) if collection else []
+
+
+def clear_scene():
+    """Deletes every object except the rig and purges the data left orphaned."""
+    bpy.ops.object.select_all(action='SELECT')
+    for obj in rig_objects():
+        obj.select_set(False)
+    bpy.ops.object.delete()
+    if hasattr(bpy.data, "orphans_purge"):
+        bpy.data.orphans_purge(do_recursive=True)
+    else:
+        bpy.ops.outliner.orphans_purge(do_recursive=True)
+
+
+def _add_area_light(collection, name, location, rotation, energy, size, color=None):
+    light_data = bpy.data.lights.new(name, 'AREA')
+    light_data.energy = energy
+    light_data.size = size
+    if color is not None:
+        light_data.color = color
+    light = bpy.data.objects.new(name, light_data)
+    light.location = location
+    light.rotation_euler = rotation
+    collection.objects.link(light)
+    return light
+
+
 def create_and_setup_camera(scene):
     """
-    Creates and sets up a camera and a three-point light system.
-    Returns the created camera object.
+    Creates and sets up a camera and a three-point light system in the rig
+    collection, or reuses the ones a previous call left there.
+    Returns the camera object.
     """
+    collection = bpy.data.collections.get(RIG_COLLECTION_NAME)
+    if collection is None:
+        collection = bpy.data.collections.new(RIG_COLLECTION_NAME)
+    if collection.name not in scene.collection.children:
+        scene.collection.children.link(collection)
+
+    camera = next((obj for obj in collection.objects if obj.type == 'CAMERA'), None)
+    if camera is not None:
+        scene.camera = camera
+        print("Reusing existing camera and three-point lighting system.")
+        return camera
+
+    # Anything left from a partially deleted rig is rebuilt from scratch
+    for obj in list(collection.objects):
+        bpy.data.objects.remove(obj)
+
     # --- Create Camera ---
-    bpy.ops.object.camera_add()
-    camera = bpy.context.object
+    camera_data = bpy.data.cameras.new("MIA_Camera")
+    camera_data.lens = 50  # Set focal length
+    camera = bpy.data.objects.new("MIA_Camera", camera_data)
+    collection.objects.link(camera)
     scene.camera = camera
-    camera.data.lens = 50  # Set focal length
 
     # --- Create a Softer, more Natural Three-Point Light System ---
-    
+    # Data-block API instead of bpy.ops, which would run a scene update per light
+
     # 1. Key Light (Main light source, slightly warm)
-    bpy.ops.object.light_add(type='AREA', location=(-4, -4, 5))
-    key_light = bpy.context.object
-    key_light.data.energy = 1000      # Reduced energy for softer light
-    key_light.data.size = 10          # Increased size for softer shadows
-    key_light.data.color = (1.0, 0.95, 0.8) # Add a warm tint
-    key_light.rotation_euler = (0, 0.7, -0.7)
+    _add_area_light(
+        collection, "MIA_KeyLight", location=(-4, -4, 5), rotation=(0, 0.7, -0.7),
+        energy=1000,               # Reduced energy for softer light
+        size=10,                   # Increased size for softer shadows
+        color=(1.0, 0.95, 0.8),    # Add a warm tint
+    )
 
     # 2. Fill Light (Softens shadows, slightly cool)
-    bpy.ops.object.light_add(type='AREA', location=(4, -2, 2))
-    fill_light = bpy.context.object
-    fill_light.data.energy = 500       # Lower energy for less contrast
-    fill_light.data.size = 12          # Greatly increased size for very soft fill
-    fill_light.data.color = (0.8, 0.9, 1.0) # Add a cool tint
-    fill_light.rotation_euler = (0, 0.5, 0.7)
+    _add_area_light(
+        collection, "MIA_FillLight", location=(4, -2, 2), rotation=(0, 0.5, 0.7),
+        energy=500,                # Lower energy for less contrast
+        size=12,                   # Greatly increased size for very soft fill
+        color=(0.8, 0.9, 1.0),     # Add a cool tint
+    )
 
     # 3. Back Light (Rim light, neutral)
-    bpy.ops.object.light_add(type='AREA', location=(2, 4, 3))
-    back_light = bpy.context.object
-    back_light.data.energy = 700      # Reduced energy for a subtler rim effect
-    back_light.data.size = 10         # Increased size
-    back_light.rotation_euler = (0.8, 0, 2.3)
+    _add_area_light(
+        collection, "MIA_BackLight", location=(2, 4, 3), rotation=(0.8, 0, 2.3),
+        energy=700,                # Reduced energy for a subtler rim effect
+        size=10,                   # Increased size
+    )
 
     print("Created camera and a softer, more natural three-point lighting system.")
     return camera
 
 
-def frame_all_objects(scene):
+def configure_preview_output(scene):
+    """
+    Configures 8-bit, non-color-managed output for preview renders: the
+    Standard view transform skips the per-pixel Filmic/AgX LUT and the 8-bit
+    buffer matches what the PNG thumbnail and palettized GIF end up holding.
+    """
+    scene.view_settings.view_transform = 'Standard'
+    scene.view_settings.look = 'None'
+    scene.render.image_settings.color_depth = '8'
+    scene.render.dither_intensity = 0.0
+    # Not available in every Blender release
+    if hasattr(scene.render, "use_high_quality_normals"):
+        scene.render.use_high_quality_normals = False
+
+# Eevee and render settings for each quality level. Every level sets the same
+# fields, so switching levels in a warm Blender process never inherits the
+# previous render's values. "preview" drops to 4 TAA samples and turns off the
+# passes a small preview can't show; "final" is the stock 16-sample setup.
+# Several Eevee fields only exist in some Blender releases.
+RENDER_QUALITY_SETTINGS = {
+    "preview": {
+        "eevee": {
+            "taa_render_samples": 4,
+            "use_gtao": False,
+            "use_bloom": False,
+            "use_ssr": False,
+            "use_motion_blur": False,
+            "use_soft_shadows": False,
+            "use_raytracing": False,
+        },
+        "render": {
+            "use_motion_blur": False,
+            "use_simplify": True,
+            "simplify_subdivision_render": 0,
+        },
+    },
+    "final": {
+        "eevee": {
+            "taa_render_samples": 16,
+            "use_gtao": False,
+            "use_bloom": False,
+            "use_ssr": False,
+            "use_motion_blur": False,
+            "use_soft_shadows": True,
+            "use_raytracing": False,
+        },
+        "render": {
+            "use_motion_blur": False,
+            "use_simplify": False,
+            "simplify_subdivision_render": 6,
+        },
+    },
+}
+RENDER_QUALITIES = tuple(RENDER_QUALITY_SETTINGS)
+
+
+def _apply_render_settings(scene, settings):
+    for owner_name, values in settings.items():
+        owner = getattr(scene, owner_name)
+        for attr, value in values.items():
+            if hasattr(owner, attr):
+                setattr(owner, attr, value)
+
+
+def capture_render_quality(scene):
+    """Snapshot of the fields configure_render_quality sets, for restore_render_quality."""
+    fields = RENDER_QUALITY_SETTINGS["final"]
+    return {
+        owner_name: {
+            attr: getattr(getattr(scene, owner_name), attr)
+            for attr in values
+            if hasattr(getattr(scene, owner_name), attr)
+        }
+        for owner_name, values in fields.items()
+    }
+
+
+def restore_render_quality(scene, snapshot):
+    """Puts back the settings captured by capture_render_quality."""
+    _apply_render_settings(scene, snapshot)
+
+
+def configure_render_quality(scene, quality):
+    """Sets Eevee samples and effects for the given RENDER_QUALITIES entry."""
+    _apply_render_settings(scene, RENDER_QUALITY_SETTINGS[quality])
+    print(f"Render samples set to {scene.eevee.taa_render_samples} for {quality} quality.")
+
+
+def is_deforming(obj):
+    """True if a mesh's local shape can change between frames (armature or shape keys)."""
+    if obj.data.shape_keys:
+        return True
+    return any(mod.type in {'ARMATURE', 'MESH_DEFORM', 'LATTICE', 'HOOK'} for mod in obj.modifiers)
+
+
+def homogeneous_corners(bound_box):
+    """An object's 8 local bounding box corners as an (8, 4) array with w = 1."""
+    corners = np.ones((8, 4))
+    corners[:, :3] = np.array(bound_box, dtype=float)
+    return corners
+
+
+def frame_all_objects(scene, sample_every=None, exact=False, padding=0.1):
     """
-    Calculates a bounding box encompassing all mesh objects across the entire
+    Calculates a bounding box encompassing all mesh objects across the
     animation range and adjusts the camera to frame this box.
+
+    By default the box is sampled at the first, middle and last frames plus
+    the rest pose, or every `sample_every` frames when given, and padded by
+    `padding` of its size to absorb extremes in between. `exact` visits every
+    frame and skips the padding.
     """
     mesh_objects = [obj for obj in scene.objects if obj.type == 'MESH']
     if not mesh_objects:
         print("No mesh objects found to frame.")
         return
 
-    min_corner = Vector((float('inf'), float('inf'), float('inf')))
-    max_corner = Vector((float('-inf'), float('-inf'), float('-inf')))
+    # Running world-space AABB folded with NumPy; converted to Vectors only
+    # for the camera math at the end
+    lo = np.full(3, np.inf)
+    hi = np.full(3, -np.inf)
+
+    def extend(matrix_world, local_corners):
+        nonlocal lo, hi
+        # One (8, 4) @ (4, 4) matmul instead of eight mathutils mat-vec products
+        world_corners = (local_corners @ np.array(matrix_world).T)[:, :3]
+        lo = np.minimum(lo, world_corners.min(axis=0))
+        hi = np.maximum(hi, world_corners.max(axis=0))
 
     original_frame = scene.frame_current
     depsgraph = bpy.context.evaluated_depsgraph_get()
 
-    for frame in range(scene.frame_start, scene.frame_end + 1):
-        scene.frame_set(frame)
-        for obj in mesh_objects:
+    # Meshes that aren't deformed keep the same local bounds on every frame, so
+    # they are evaluated once and only their world matrix is read per frame.
+    deforming = [obj for obj in mesh_objects if is_deforming(obj)]
+    static = [obj for obj in mesh_objects if obj not in deforming]
+    static_local_corners = {
+        obj.name: homogeneous_corners(obj.evaluated_get(depsgraph).bound_box)
+        for obj in static
+    }
+
+    start, end = scene.frame_start, scene.frame_end
+    if exact:
+        frames = range(start, end + 1)
+        padding = 0.0
+    elif sample_every:
+        frames = sorted(set(range(start, end + 1, sample_every)) | {end})
+    else:
+        frames = sorted({start, (start + end) // 2, end})
+
+    def extend_deforming():
+        for obj in deforming:
             obj_eval = obj.evaluated_get(depsgraph)
-            world_bbox_corners = [obj_eval.matrix_world @ Vector(corner) for corner in obj_eval.bound_box]
-            
-            for corner in world_bbox_corners:
-                min_corner.x = min(min_corner.x, corner.x)
-                min_corner.y = min(min_corner.y, corner.y)
-                min_corner.z = min(min_corner.z, corner.z)
-                max_corner.x = max(max_corner.x, corner.x)
-                max_corner.y = max(max_corner.y, corner.y)
-                max_corner.z = max(max_corner.z, corner.z)
+            extend(obj_eval.matrix_world, homogeneous_corners(obj_eval.bound_box))
+
+    for frame in frames:
+        scene.frame_set(frame)
+        for obj in static:
+            extend(obj.matrix_world, static_local_corners[obj.name])
+        extend_deforming()
+
+    # A character's rest pose usually spans extremes (e.g. T-pose arms) the sampled frames can miss
+    armatures = [obj for obj in scene.objects if obj.type == 'ARMATURE' and obj.data.pose_position == 'POSE']
+    if not exact and deforming and armatures:
+        for armature in armatures:
+            armature.data.pose_position = 'REST'
+        bpy.context.view_layer.update()
+        extend_deforming()
+        for armature in armatures:
+            armature.data.pose_position = 'POSE'
 
     scene.frame_set(original_frame)
 
-    if min_corner.x == float('inf'):
+    if not np.isfinite(lo).all():
         print("Could not determine the bounding box of the objects.")
         return
+    margin = (hi - lo) * (padding / 2.0)
+    min_corner = Vector((lo - margin).tolist())
+    max_corner = Vector((hi + margin).tolist())
 
     # --- 2. Use the bounding box to determine camera placement ---
     center = (min_corner + max_corner) / 2.0